@@ -22,6 +22,8 @@
 #             note
 #           - On the bottom, displays the assumed target note by lighting up one of six LEDs green
 #             corresponding to the six open-string notes of a guitar in standard EADGBE tuning.
+#           - In chromatic mode the target is the nearest note of any octave instead, and the bottom half
+#             of the ring has one LED for each of the 12 note names.
 #       - Thingspeak channel
 #           - Field 1 contains detected frequency data
 #           - Field 2 contains the total time it took to tune the guitar
@@ -34,11 +36,17 @@
 import time
 import board
 from analogio import AnalogIn
-import math
 import neopixelFunctions
 import espFunctions
 import motorFunctions
-import ulab
+import correlationFunctions
+import pitchFunctions
+import captureFunctions
+import pipelineFunctions
+import frameFunctions
+import trackingFunctions
+import tuningFunctions
+from arrayFunctions import np, as_samples
 
 
 
@@ -47,180 +55,289 @@ import ulab
 #-------------------- Functions ---------------------------
 
 
-# returns the value of the analog pin in volts
-def get_voltage(pin):
-    return (pin.value * 3.3) / 65536
+# converts a raw 16-bit reading of an analog pin into volts
+def to_voltage(value):
+    return (value * 3.3) / 65536
 
 
-# centers the inputted waveform to revolve around 0
-def center(array):
-    avg = float(sum(array) / len(array))
-    for x in range(len(array)):
-        array[x] = (array[x] - avg)
-    return array
+# returns the value of the analog pin in volts
+def get_voltage(pin):
+    return to_voltage(pin.value)
 
 
 # This function is the pitch detection algorithm.
-# It uses ulab to implement an autocorrelation technique for finding the period of the waveform via
-#   convolution.
-# It takes a small portion of the waveform sample and convolves it against the entire waveform to
+# It uses ulab to implement an autocorrelation technique for finding the period of the waveform.
+# It takes a small portion of the waveform sample and correlates it against the entire waveform to
 #   plot out the overlap of the signals over the timeshift/lag, then measures the distance between
 #   two peaks of the result, giving the period of the original signal.
-# Since the convolution function reverses the second input wave (as is normal for convolution),
-#   the small portion is flipped first to negate this.
+# The correlation is computed by the engine selected in correlation_engine (see correlationFunctions),
+#   either by direct convolution or through the FFT, which is much faster for a full 2048 sample frame.
 def get_freq_correlation(wave, time_delta):
-    length = len(wave)
-    # Controlls the size of the signal cutout, in number of samples.
-    sample_size = 512
+    # Controlls the size of the signal cutout, in number of samples, a quarter of the frame up to 512.
+    sample_size = min(512, len(wave) // 4)
     # Controlls the threshold at which the function registers a peak relative to the max value of
     #   the correlation wave.
     threshold = 0.91
 
-    # Computes the correlation through ulab functions.
-    uwave = ulab.array(wave)
-    correlation = ulab.filter.convolve(uwave, ulab.numerical.flip(uwave[0:sample_size]))
-    match = ulab.numerical.max(correlation)
-    match_location = ulab.numerical.argmax(correlation)
-
-    local_max = []
-    local_max.clear()
-    count = 0
-
-    # Starting at the absolute max of the correlation wave, it goes through the array until it
-    #   leaves the first peak.
-    while correlation[match_location + count] >= (match * threshold):
-        count += 1
-        if (match_location + count) == len(correlation):
-            return 0.0
-
-    # It then waits until it registers another peak, depending on the set threshold of the
-    #   absolute max value
-    while correlation[match_location + count] < (match * threshold):
-        count += 1
-        if (match_location + count) == len(correlation):
-            return 0.0
-    start = count
-
-    # once a new peak is registered, it records the whole peak into a new array and stops when it
-    #   leaves the peak threshold
-    while correlation[match_location + count] >= (match * threshold):
-        local_max.append(correlation[match_location + count])
-        count += 1
-        if (match_location + count) == len(correlation):
-            return 0.0
-
-    # finds the exact location of the second peak
-    second_peak = ulab.numerical.argmax(local_max)
+    if correlation_mode == "band":
+        # only computes and searches the lags for the frequencies display_freq can show
+        lag = correlationFunctions.get_lag_band(wave, time_delta, correlation_engine, sample_size, threshold,
+                                                tuning_low, tuning_high)
+    elif correlation_mode == "multirate":
+        # finds the period on a decimated copy of the wave first, then refines it at the full rate
+        lag = correlationFunctions.get_lag_multirate(wave, time_delta, 4, correlation_engine, sample_size,
+                                                     threshold, tuning_low, tuning_high)
+    else:
+        correlation = correlationFunctions.correlate(wave, correlation_engine, sample_size)
+        # finds the distance between the absolute max and the next peak, in samples
+        lag = correlationFunctions.pick_peaks(correlation, threshold)
+    if lag == 0:
+        return 0.0
+
     # calculates the period of the signal
-    period = float((second_peak + start) * time_delta)
+    period = float(lag * time_delta)
     # calculates and returns the frequency
     frequency = float(1/period)
-    if period == 0:
-        frequency = 0.0
     return frequency
 
 
-# This is the function for displaying the detected frequency on the pitch meter.
-# The function first finds which note the frequency is closest to based on a predefined list of
-#   reference points.
-# It then calculates how many half-steps (or semitones in the UK) either sharp or flat the
-#   frequency is compared to the target note.
-# The meter then displays how sharp or flat the detected note is with a boundary of 2.5 half-steps
-#   to either side.
-# The relationship between the frequency and the percieved pitch is not linear, but instead
-#   logarithmic, so it calculates the half-steps using a logarithmic function based on the current
-#   tuning standard of 12 Tone Equal Temperament, which divides each octave equally into 12 half-steps.
-def display_freq(frequency):
-
-    if (frequency >= 71.326) and (frequency < E2_A2_midpoint):
-
-        neopixelFunctions.bar_graph((255, 255, 255), 22, True, 16, ring, False)
-        neopixelFunctions.set_pixel((0, 255, 0), 21)
+# The YIN pitch detection of pitchFunctions, searching only the range of the tuning like the band modes of
+#   get_freq_correlation do.
+def get_freq_yin(wave, time_delta):
+    return pitchFunctions.get_freq_yin(wave, time_delta, 0.15, tuning_low, tuning_high)
 
-        myMotor.set_position_degrees(dial_center_pos +(meter_bounds*((12/2.5)*math.log(freq/E2, 2))))
 
-    elif (frequency >= E2_A2_midpoint) and (frequency < A2_D3_midpoint):
+# The Goertzel detector of pitchFunctions, picking from the notes of the tuning instead of standard tuning,
+#   searching only within the spread of its notes.
+def get_freq_goertzel(wave, time_delta):
+    return pitchFunctions.get_freq_goertzel(wave, time_delta, tuning.get_freqs(), 8, tuning.get_spread())
 
-        neopixelFunctions.bar_graph((255, 255, 255), 22, True, 16, ring, False)
-        neopixelFunctions.set_pixel((0, 255, 0), 20)
 
-        myMotor.set_position_degrees(dial_center_pos +(meter_bounds*((12/2.5)*math.log(freq/A2, 2))))
+# The harmonic product spectrum of pitchFunctions, searching only the range of the tuning.
+def get_freq_hps(wave, time_delta):
+    return pitchFunctions.get_freq_hps(wave, time_delta, 4, 2, tuning_low, tuning_high)
 
-    elif (frequency >= A2_D3_midpoint) and (frequency < D3_G3_midpoint):
 
-        neopixelFunctions.bar_graph((255, 255, 255), 22, True, 16, ring, False)
-        neopixelFunctions.set_pixel((0, 255, 0), 19)
+# The pitch detection while the string lock is locked, which only searches the window of the locked string.
+# In chromatic mode that is YIN too, since the windows of the high notes are only a few lags wide, and the
+#   correlation of the string lock is off by several cents that close to the sample rate.
+def detect_locked(wave, time_delta):
+    if chromatic:
+        low, high = string_lock.get_band()
+        return pitchFunctions.get_freq_yin(wave, time_delta, 0.15, low, high)
+    return string_lock.detect(wave, time_delta)
 
-        myMotor.set_position_degrees(dial_center_pos +(meter_bounds*((12/2.5)*math.log(freq/D3, 2))))
 
-    elif (frequency >= D3_G3_midpoint) and (frequency < G3_B3_midpoint):
-
-        neopixelFunctions.bar_graph((255, 255, 255), 22, True, 16, ring, False)
-        neopixelFunctions.set_pixel((0, 255, 0), 18)
+# This is the function for displaying the detected frequency on the pitch meter.
+# The function first finds which note of the tuning the frequency is closest to, with a binary search of
+#   the midpoints between the notes (see tuningFunctions), and lights up that note's LED.
+# It then calculates how many half-steps (or semitones in the UK) either sharp or flat the
+#   frequency is compared to the target note.
+# The meter then displays how sharp or flat the detected note is with a boundary of 2.5 half-steps
+#   to either side, or half a half-step (50 cents) in chromatic mode, where the next note is only a
+#   half-step away.
+# The relationship between the frequency and the percieved pitch is not linear, but instead
+#   logarithmic, so it calculates the half-steps using a logarithmic function based on the current
+#   tuning standard of 12 Tone Equal Temperament, which divides each octave equally into 12 half-steps.
+# The colors come from the palette already checked and scaled, so drawing them is just setting the LEDs.
+def display_freq(frequency):
 
-        myMotor.set_position_degrees(dial_center_pos +(meter_bounds*((12/2.5)*math.log(freq/G3, 2))))
+    background = neopixelFunctions.get_color(white)
+    for led in range(first_note_led, last_note_led):
+        display[led] = background
 
-    elif (frequency >= G3_B3_midpoint) and (frequency < B3_E4_midpoint):
+    note = tuning.lookup(frequency)
+    if note is not None:
+        display[tuning.get_led(note)] = neopixelFunctions.get_color(green)
+        print('note: ', tuning.get_name(note), '\n')
 
-        neopixelFunctions.bar_graph((255, 255, 255), 22, True, 16, ring, False)
-        neopixelFunctions.set_pixel((0, 255, 0), 17)
+        offset = tuning.get_offset(frequency, note)
+        if use_motor:
+            myMotor.set_position_degrees(dial_center_pos +(meter_bounds*(offset/tuning.get_spread())))
+        else:
+            cents_meter.draw(100 * offset, display)
+    return
 
-        myMotor.set_position_degrees(dial_center_pos +(meter_bounds*((12/2.5)*math.log(freq/B3, 2))))
 
-    elif (frequency >= B3_E4_midpoint) and (frequency < 380.836):
 
-        neopixelFunctions.bar_graph((255, 255, 255), 22, True, 16, ring, False)
-        neopixelFunctions.set_pixel((0, 255, 0), 16)
 
-        myMotor.set_position_degrees(dial_center_pos +(meter_bounds*((12/2.5)*math.log(freq/E4, 2))))
 
-    else:
-        neopixelFunctions.bar_graph((255, 255, 255), 22, True, 16, ring, False)
-    return
+#------------------ Initializations and Setup ----------------------
 
 
+# Selects the tuning, one of the presets in tuningFunctions.PRESETS ("standard", "drop D", "DADGAD",
+#   "open G", "half-step down", "7-string" or "bass"), and the frequency of A4 it is worked out from.
+# The pitch detection searches the range from 2.5 half-steps below the lowest note of the tuning to 2.5
+#   above the highest, which is also the range display_freq acts on.
+# Set chromatic to True to tune any note from 30 Hz to 1.5 kHz to its nearest note instead (see
+#   ChromaticTable in tuningFunctions), for other instruments or alternate tunings that aren't presets.
+#   The pitch detection and the filters then search that whole range.
+chromatic = False
+if chromatic:
+    tuning = tuningFunctions.ChromaticTable(440.0, 30.0, 1500.0)
+else:
+    tuning = tuningFunctions.get_tuning("standard", 440.0)
+tuning_low, tuning_high = tuning.get_band()
+# the LEDs of the notes, from first_note_led up to (not including) last_note_led
+first_note_led = min(tuning.get_leds())
+last_note_led = max(tuning.get_leds()) + 1
+
+# The rate the audio is sampled at, in Hz (see the audio input below)
+sample_rate = 10000
+
+# Selects how the autocorrelation is computed, either correlationFunctions.ENGINE_FFT or
+#   correlationFunctions.ENGINE_CONVOLVE (the original direct convolution)
+correlation_engine = correlationFunctions.ENGINE_FFT
+
+# Selects which lags get_freq_correlation computes:
+#   "full" computes every lag and finds the peaks from the absolute max (the original method)
+#   "band" only computes the lags over the range of the tuning (the range display_freq acts on) and picks
+#       the peak in that window
+#   "multirate" does the band search on a 4x decimated copy of the wave, then refines the period with
+#       just the few full rate lags around it
+correlation_mode = "band"
+
+# Selects the pitch detection algorithm. None, the default, uses the band-limited correlation of the frame
+#   context (see below), which works in the context's own buffers, so the only thing a frame allocates
+#   is the output of the filters. Every other detector makes new arrays for every frame, which the
+#   garbage collector has to stop the tuner to clean up sooner or later.
+# get_freq_correlation and get_freq_yin take the filtered wave and the time step and return the frequency
+#   in Hz (0.0 if none was found).
+# YIN interpolates between samples, so it reaches the same accuracy with a quarter of the samples per
+#   reading, which is why the frame size is smaller when it is used. It still needs two periods of the
+#   lowest note, so tunings that go below 40 Hz (bass, chromatic) get twice as many.
+# get_freq_goertzel is another option, which picks the note of the tuning with a bank of Goertzel filters
+#   first and then only searches for the period near that note.
+# get_freq_hps finds the pitch in the spectrum instead, with the harmonic product spectrum.
+# In chromatic mode the band-limited correlation can't be used, over 30 Hz to 1.5 kHz the multiples of the
+#   period of a high note are in the band too, and the highest one wins. None is YIN there instead, which
+#   takes the first dip of its difference function, so it finds the shortest period. get_freq_goertzel is
+#   YIN there too, its bank would need filters around every note up to 1.5 kHz, on a wave that can only
+#   be decimated by 2, which is more memory than the board has to spare.
+pitch_detector = None
+if chromatic and pitch_detector in (None, get_freq_goertzel):
+    pitch_detector = get_freq_yin
+if pitch_detector == get_freq_yin and tuning_low >= 40:
+    power = 512
+elif pitch_detector == get_freq_yin:
+    power = 1024
+else:
+    power = 2048
 
+# Set use_streaming to True to use the streaming correlator instead of pitch_detector.
+# Every reading then only captures hop_size new samples and updates the correlation of the last 2048
+#   samples with them, instead of capturing and correlating a whole new frame, so readings come
+#   2048/hop_size times as often.
+# The hops go through a ring buffer like overlapping frames do (see frame_hop below), so it only works
+#   hop by hop while the capture keeps up. After a gap (on the board the capture stops while each reading
+#   is processed) the ring first captures a whole 2048 new samples, and the correlator starts over from
+#   those, so it never correlates across a gap and still gives a reading for every frame.
+use_streaming = False
+hop_size = 256
+if use_streaming:
+    power = 2048
 
+# Set frame_hop below power (like power // 4) to overlap the frames, a new frame of power samples then
+#   starts every frame_hop samples, so the tuner gives power/frame_hop readings in the time it used to give
+#   one without analyzing any fewer samples.
+# Each reading only captures the frame_hop new samples into a ring buffer and reuses the rest of the
+#   last frame from it without copying (see FrameRing in captureFunctions). But the capture stops while a
+#   frame is processed, and hops with a gap between them can't be joined into one frame, so after every gap
+#   the ring has to fill a whole frame again. That only pays off if the capture keeps up without gaps,
+#   so the overlap is off (frame_hop = power) by default.
+# The streaming correlator always uses the ring, with hops of hop_size.
+frame_hop = power
+
+# Set adaptive_frames to True to capture frames that are only as long as they need to be instead of
+#   overlapping them: about 8 periods of the note being played (or of the string it is locked onto), from
+#   min_frame up to power samples. High strings then get frames that come several times as often, and low
+#   strings longer ones with steadier readings. The frames come from a pool of preallocated buffers.
+# The pitch detection only looks at the samples of the frame that was captured, the filters still hold
+#   older samples from before it, which don't follow on from it. The shortest frames still hold two periods
+#   of the lowest note of the tuning, so a frame that is too short for a new note can still find it.
+adaptive_frames = False
+min_frame = max(256, 2 * int(sample_rate / tuning_low))
+frame_length = power
+
+if use_streaming:
+    frame_hop = hop_size
+    frames = captureFunctions.FrameRing(power, frame_hop)
+elif adaptive_frames:
+    frame_hop = power
+    frames = captureFunctions.FramePool(power, 2, min_frame)
+elif frame_hop >= power:
+    frame_hop = power
+    frames = captureFunctions.FrameBuffers(power, 2)
+else:
+    frames = captureFunctions.FrameRing(power, frame_hop)
 
-#------------------ Initializations and Setup ----------------------
 
 
-# Sets up the audio signal input
+# Sets up the audio signal input.
+# The capture fills a preallocated buffer of raw samples in one call, using the ADC's own clock when the
+#   board supports it (see captureFunctions).
+# Otherwise the samples are paced at sample_rate and timestamped. Where the loop can't keep up with
+#   sample_rate (on the Feather M4 it may not hold 10 kHz) it runs as fast as it can, and the time step
+#   of each frame is measured, so the pitch comes out right either way. The lags the pitch detection
+#   searches are worked out from sample_rate though, so it should be about what the capture actually runs at.
 kill_switch = AnalogIn(board.A0)
-audio_in = AnalogIn(board.A1)
+audio_in = captureFunctions.get_capture(board.A1, sample_rate, paced=True)
+
+# Sets up the pipeline that captures the audio into the frames. On a computer it captures on a thread, so the
+#   next frame is filled while the last one is still being processed. On the board it uses asyncio tasks if the
+#   asyncio library is there, but a capture holds the processor until its frame is full, so that only switches
+#   between them at the yields of process_frame and doesn't overlap them. Without asyncio it just captures and
+#   processes one after the other.
+pipeline = pipelineFunctions.get_pipeline(audio_in, frames)
+
+# Sets up the streaming correlator, only when it is used since its buffers take up about 20 KB.
+# It keeps the lags up to a bit past the period of the lowest frequency of the tuning, since the peak at
+#   that period has to be found all the way to where it falls off again.
+if use_streaming:
+    streaming_correlator = correlationFunctions.StreamingCorrelator(power, int(1.1 * sample_rate / tuning_low) + 2,
+                                                                    hop_size)
+
+# Sets up the frame context, which owns every buffer the processing of a frame needs so they aren't
+#   allocated again for every frame (see frameFunctions). It also measures the bytes allocated per frame.
+# The audio goes through its filters before the pitch detection, a DC blocker that takes out the offset
+#   of the input (what center() used to do) and a band-pass over the range of the strings.
+# They keep their state from one frame to the next, so only the frame_hop new samples of each frame
+#   are filtered (see filterFunctions).
+frame_context = frameFunctions.FrameContext(power, sample_rate, 512, tuning_low, tuning_high)
+
+# Sets up the silence gate, which only lets the pitch detection run while a string is ringing loud enough.
+# It opens when the RMS of the new samples goes above gate_open and closes when it drops below gate_close
+#   (both in raw ADC counts, so they depend on the volume of the amp and may need adjusting).
+gate_open = 400
+gate_close = 200
+gate = trackingFunctions.SilenceGate(gate_open, gate_close)
+
+# Sets up the pitch tracker, which smooths the detected frequency from one reading to the next and snaps
+#   readings that jumped by an octave back to the note being played (see trackingFunctions).
+# The meter only moves for readings with a confidence of at least min_confidence, so the motor doesn't
+#   step back and forth after every bad reading.
+tracker = trackingFunctions.PitchTracker()
+min_confidence = 0.6
 
 
 
 # Sets up the motor and defines the centerpoint and boundaries for the pitch meter
-myMotor = motorFunctions.ECEGMotor(False)
+# Set use_motor to False to show how sharp or flat the note is on the top LEDs instead of the dial (see
+#   the cents meter below), which doesn't wait for the motor to step so it keeps up with every reading.
+use_motor = True
+if use_motor:
+    myMotor = motorFunctions.ECEGMotor(False)
 
 dial_center_pos = 151
 meter_bounds = 61
 
 
 
-# Designated open-string notes and their frequencies (Hz):
-E2 = 82.407
-
-E2_A2_midpoint = 95.209
-
-A2 = 110.000
-
-A2_D3_midpoint = 127.089
-
-D3 = 146.832
-
-D3_G3_midpoint = 169.643
-
-G3 = 195.998
-
-G3_B3_midpoint = 220.000
-
-B3 = 246.942
-
-B3_E4_midpoint = 285.305
-
-E4 = 329.628
+# Sets up the string lock. Once 4 readings in a row are within 2.5 half-steps of the same string, the pitch
+#   detection only searches that string's window, on just enough of the end of the frame for 6 of its
+#   periods, until a reading is silent or jumps out of the window (see trackingFunctions).
+# In chromatic mode every note is a "string", with a window of half a half-step.
+string_lock = trackingFunctions.StringLock(tuning.get_freqs(), 4, tuning.get_spread())
 
 
 # Sets up the esp and connects to the thingspeak channel
@@ -254,24 +371,45 @@ print("Done!")
 
 
 # initiallizing the LEDS
+# Everything is drawn on a frame buffer instead of straight on the ring, and sent with display.show() once
+#   per frame, which only sends anything if the LEDs changed (see neopixelFunctions).
 ring = neopixelFunctions.get_ring()
-neopixelFunctions.bar_graph((255, 0, 0), 11, True, 3, ring, False)
-neopixelFunctions.bar_graph((255, 100, 0), 10, True, 4, ring, False)
-neopixelFunctions.bar_graph((255, 255, 0), 9, True, 5, ring, False)
-neopixelFunctions.bar_graph((0, 255, 0), 8, True, 6, ring, False)
+display = neopixelFunctions.FrameBuffer(ring)
+# The colors the tuner uses are added to the palette, which checks them once and bakes the brightness
+#   into them, so the ring doesn't have to scale every color it is sent.
+red = neopixelFunctions.add_color((255, 0, 0))
+orange = neopixelFunctions.add_color((255, 100, 0))
+yellow = neopixelFunctions.add_color((255, 255, 0))
+green = neopixelFunctions.add_color((0, 255, 0))
+white = neopixelFunctions.add_color((255, 255, 255))
+neopixelFunctions.bake_brightness(neopixelFunctions.BRIGHTNESS, 1.0, ring)
+# The top LEDs are the background of the dial, or without the motor a cents meter: from 50 cents flat on
+#   LED 3 to 50 cents sharp on LED 10, with the LED of the offset lit brightly over a dim gradient from red
+#   at the ends to green in the middle. In tune lights both LEDs 6 and 7, the two in the middle.
+if use_motor:
+    neopixelFunctions.bar_graph(red, 11, True, 3, display, False)
+    neopixelFunctions.bar_graph(orange, 10, True, 4, display, False)
+    neopixelFunctions.bar_graph(yellow, 9, True, 5, display, False)
+    neopixelFunctions.bar_graph(green, 8, True, 6, display, False)
+else:
+    cents_meter = neopixelFunctions.get_cents_meter(3, 11, 50.0, green, red)
+    cents_meter.draw(0.0, display)
 # The bottom LEDS will be lit red while the program waits for the kill switch to be reset
-neopixelFunctions.bar_graph((255, 0, 0), 22, True, 16, ring, False)
+neopixelFunctions.bar_graph(red, last_note_led, True, first_note_led, display, False)
+display.show()
 
 
 # centers the dial on the pitch meter
-myMotor.set_position_degrees(dial_center_pos)
+if use_motor:
+    myMotor.set_position_degrees(dial_center_pos)
 
 # waits for the kill_switch to be turned off before starting the program
 while get_voltage(kill_switch) > 0.5:
     print("Reset the kill switch to start")
     time.sleep(1)
 # bottom LED bar turns white when kill switch is reset
-neopixelFunctions.bar_graph((255, 255, 255), 22, True, 16, ring, False)
+neopixelFunctions.bar_graph(white, last_note_led, True, first_note_led, display, False)
+display.show()
 
 
 
@@ -279,45 +417,133 @@ neopixelFunctions.bar_graph((255, 255, 255), 22, True, 16, ring, False)
 #------------------------------- Main Loop --------------------------------------
 
 
-count = 0
-loop = True
-tuning_start_time = time.monotonic()
-while loop:
-
-    # samples the audio voltage signal for about 164 ms and stores it all in a list
-    power = 2048
-    wave = []
-    wave.clear()
-
-    start_time = time.monotonic_ns()
-    for x in range(power):
-        wave.append(get_voltage(audio_in))
-    end_time = time.monotonic_ns()
-
-    # calculates the total time of the sample and the time step between each sample instance
-    total_time = float((end_time - start_time)/1000000000)
-    time_step = float(total_time/power)
+# This function handles one captured frame of raw samples: it detects, displays and uploads the
+#   frequency, and checks the kill switch.
+# It yields between its stages, so while it is waiting to continue the pipeline can already be capturing
+#   the next frame (see pipelineFunctions).
+def process_frame(samples, time_step):
+    global count
+
+    # The new raw samples, as they came from the ADC. The pitch doesn't depend on the scale of the signal,
+    #   so they are never converted to volts, and this is a view of the frame, not a copy of it.
+    wave = as_samples(samples[max(0, len(samples) - frame_hop):])
+
+    # Skips everything but the kill switch while nothing is being played (or the string has died down too
+    #   far to be detected), so the meter, the motor and thingspeak don't get readings of the noise.
+    #   The readings that found no pitch as the string died down don't count against the confidence of the
+    #   next note either.
+    if not gate.update(wave):
+        string_lock.unlock()
+        tracker.forget_silence()
+        set_frame_length(0.0, time_step)
+        update_leds()
+        check_kill_switch()
+        return
+
+    # On a new pluck the filters and the tracker start over instead of carrying on from the last note.
+    # The filters (or the streaming correlator) also start over when the capture stopped before this frame
+    #   (see is_fresh in captureFunctions), since its samples don't follow on from the ones they have seen,
+    #   and take the whole frame, which the ring has captured all in one go since the gap.
+    #   The DC blocker starts from the offset of the new samples, so it doesn't have to settle again.
+    if gate.is_onset():
+        tracker.reset()
+    fresh = frames.is_fresh(samples)
+    if use_streaming:
+        if fresh:
+            streaming_correlator.reset()
+            wave = as_samples(samples)
+    elif fresh or gate.is_onset():
+        frame_context.reset(float(np.mean(wave)))
+        wave = as_samples(samples)
 
     # calculates and displays the frequency of the signal sample
-    freq = get_freq_correlation(center(wave), time_step)
-    print('frequency: ', freq, 'Hz\n')
-    display_freq(freq)
+    if use_streaming:
+        for start in range(0, len(wave), hop_size):
+            streaming_correlator.push(wave[start:start + hop_size])
+        freq = streaming_correlator.get_freq(time_step)
+    elif string_lock.is_locked():
+        freq = frame_context.process(wave, time_step, detect_locked)
+    else:
+        freq = frame_context.process(wave, time_step, pitch_detector, len(samples))
+    string_lock.update(freq)
+    # a frame without a pitch goes back to the longest frames, instead of staying sized for the pitch the
+    #   tracker still holds on to, since it may have been too short to find the new note in
+    found = freq > 0
+    freq = tracker.update(freq)
+    set_frame_length(string_lock.get_string() or (freq if found else 0.0), time_step)
+    print('frequency: ', freq, 'Hz, confidence: ', tracker.get_confidence(), '\n')
+    yield
+
+    if tracker.get_confidence() >= min_confidence:
+        animator.stop(start_up)
+        display_freq(freq)
+    update_leds()
     count += 1
+    yield
 
     # Pushes the current detected frequency to the thingspeak channel.
     # It's limited to only push every 20 samples because it adds a lot of execution time.
     if count == 20:
         tool_time.push_to_field(1, freq)
-        print('')
+        print('allocated per frame: ', frame_context.get_allocated(), 'bytes, at most',
+              frame_context.get_max_allocated(), 'bytes\n')
         count = 0
 
-    # If the kill switch is turned all the way up, it measures the total time it took to tune the
-    #   guitar (in seconds), then pushes this time to the thingspeak server, sets the bottom LED
-    #   bar to all green, and stops the program.
+    check_kill_switch()
+
+
+# Draws the next frame of any animation that is due over the display, and sends the LEDs that changed.
+def update_leds():
+    animator.tick()
+    display.show()
+
+
+# The start-up animation, a rainbow around the note LEDs in 33 frames, which then turns them white.
+def start_up_animation():
+    for frame in neopixelFunctions.rainbow_frames(last_note_led, first_note_led, 16, 2,
+                                                  neopixelFunctions.BRIGHTNESS, display):
+        yield
+    neopixelFunctions.bar_graph(white, last_note_led, True, first_note_led, display, False)
+    yield
+
+
+# Sizes the next frames for about 8 periods of `expected` Hz (0 for the longest frames, when there is
+#   no pitch to go by).
+def set_frame_length(expected, time_step):
+    global frame_length
+    frame_length = captureFunctions.get_frame_length(expected, time_step, 8, min_frame, power)
+    if adaptive_frames:
+        frames.set_length(frame_length)
+
+
+# If the kill switch is turned all the way up, it measures the total time it took to tune the
+#   guitar (in seconds), then pushes this time to the thingspeak server, sets the bottom LED
+#   bar to all green, and stops the program.
+def check_kill_switch():
     if get_voltage(kill_switch) > 2.0:
         total_tuning_time = time.monotonic() - tuning_start_time
         print("total tuning time: ", total_tuning_time, 'seconds\n')
         tool_time.push_to_field(2, total_tuning_time)
         print('')
-        neopixelFunctions.bar_graph((0, 255, 0), 22, True, 16, ring, False)
-        loop = False
\ No newline at end of file
+        animator.stop()
+        neopixelFunctions.bar_graph(green, last_note_led, True, first_note_led, display, False)
+        display.show()
+        pipeline.stop()
+
+
+# Captures a new frame (or hop of a frame) while the last one is being processed, and runs until the kill
+#   switch stops it.
+# If the capture keeps throwing frames away (when it can't keep up with sample_rate), the kill switch is
+#   still checked every half a second or so.
+# The animations run in between the frames (see Animator in neopixelFunctions), so the start-up animation
+#   plays while the tuner is already listening. It is only drawn once per frame though (the capture holds
+#   the processor while it runs), so at a handful of frames a second it takes several seconds rather than
+#   the one second its 30 frames a second would. It is stopped as soon as a note is displayed, so it
+#   never covers the note LEDs once there is something to show on them.
+animator = neopixelFunctions.Animator()
+start_up = start_up_animation()
+animator.start(start_up, 30)
+count = 0
+tuning_start_time = time.monotonic()
+pipeline.run(process_frame, check_kill_switch)
+print("capture duty cycle: ", pipeline.get_duty_cycle() * 100, '%\n')
@@ -0,0 +1,183 @@
+"""
+Array backend shared by the signal processing modules of the tuner
+
+On the Feather this is ulab's numpy compatible module (CircuitPython 7 and newer),
+on a normal computer it falls back to NumPy so the same code can be run and benchmarked
+on the host.
+
+`np` is the array module itself and `BACKEND` is either "ulab" or "numpy".
+The few places where ulab and NumPy disagree (mostly the FFT, which returns a (real, imag)
+tuple on ulab and a complex array on NumPy) are wrapped by the functions in here.
+"""
+
+try:
+    from ulab import numpy as np
+    from ulab import scipy as sp
+    BACKEND = "ulab"
+    FLOAT = np.float
+except ImportError:
+    import numpy as np
+    BACKEND = "numpy"
+    FLOAT = np.float64
+    try:
+        import scipy.signal
+        sp = scipy
+    except ImportError:
+        sp = None
+
+
+def as_float(wave):
+    """
+    Returns `wave` (a list, array.array or ndarray) as a float ndarray
+
+    Arrays that are already float are returned as they are, so this is free on the hot path
+    """
+    if isinstance(wave, np.ndarray) and wave.dtype == FLOAT:
+        return wave
+    return np.array(wave, dtype=FLOAT)
+
+
+def as_samples(buffer):
+    """
+    Returns a buffer of raw 16-bit samples (an array('H') or a memoryview of one) as a uint16 ndarray
+
+    The ndarray shares the buffer's memory instead of copying it, and no Python object is made per sample,
+    so converting it to floats later (with `as_float`) is a single allocation done entirely in C
+    """
+    return np.frombuffer(buffer, dtype=np.uint16)
+
+
+def next_pow2(n):
+    """Returns the smallest power of 2 that is greater than or equal to n"""
+    size = 1
+    while size < n:
+        size <<= 1
+    return size
+
+
+def __pad(wave, n_fft):
+    """
+    Just a private method for zero padding `wave` to n_fft samples
+
+    ulab's fft only takes powers of 2 and has no `n` argument like NumPy does
+    """
+    if len(wave) == n_fft:
+        return wave
+    padded = np.zeros(n_fft, dtype=FLOAT)
+    padded[0:len(wave)] = wave
+    return padded
+
+
+def __split(result):
+    """Splits an fft result into its (real, imag) parts on either backend"""
+    if isinstance(result, tuple):
+        return result
+    return np.real(result), np.imag(result)
+
+
+def cross_correlate_fft(wave, template, n_fft):
+    """
+    Returns the n_fft point circular cross-correlation of `wave` and `template` computed with the FFT
+
+    Both are zero padded to n_fft points (a power of 2), and value k of the result is the sum of
+    wave[i + k] * template[i]. The correlation is the inverse transform of the cross power spectrum
+    X * conj(T), which when the template is the wave itself is just its power spectrum |X|^2
+    (the Wiener-Khinchin theorem)
+    """
+    if BACKEND == "numpy":
+        spectrum = np.fft.rfft(wave, n_fft) * np.conj(np.fft.rfft(template, n_fft))
+        return np.fft.irfft(spectrum, n_fft)
+
+    wave_real, wave_imag = __split(np.fft.fft(__pad(wave, n_fft)))
+    if template is wave:
+        real = wave_real * wave_real + wave_imag * wave_imag
+        imag = np.zeros(n_fft, dtype=FLOAT)
+    else:
+        template_real, template_imag = __split(np.fft.fft(__pad(template, n_fft)))
+        real = wave_real * template_real + wave_imag * template_imag
+        imag = wave_imag * template_real - wave_real * template_imag
+    real, imag = __split(np.fft.ifft(real, imag))
+    return real
+
+
+def power_spectrum(wave, n_fft):
+    """
+    Returns the power |X|^2 of `wave` zero padded to n_fft points (a power of 2), for the bins from 0 up to
+    and including n_fft / 2. Bin k is at k / (n_fft * time_delta) Hz
+    """
+    if BACKEND == "numpy":
+        spectrum = np.fft.rfft(wave, n_fft)
+        return np.real(spectrum) ** 2 + np.imag(spectrum) ** 2
+
+    real, imag = __split(np.fft.fft(__pad(as_float(wave), n_fft)))
+    half = n_fft // 2 + 1
+    return real[0:half] * real[0:half] + imag[0:half] * imag[0:half]
+
+
+def cumsum(values):
+    """
+    Returns the running total of `values`, value k of the result is the sum of values[0] to values[k]
+
+    ulab doesn't have cumsum, so on the board this is a plain loop. Only use it on short arrays there
+    """
+    if BACKEND == "numpy":
+        return np.cumsum(values)
+
+    total = np.zeros(len(values), dtype=FLOAT)
+    running = 0.0
+    for i in range(len(values)):
+        running += values[i]
+        total[i] = running
+    return total
+
+
+# Arrays of ones for `running_sum`, keyed by window length
+__ones = {}
+
+
+def running_sum(values, window, count):
+    """
+    Returns the sums of values[k:k + window] for k from 0 to count - 1
+
+    On NumPy this is a difference of the cumulative sum, on ulab it's the correlation against a
+    window of ones through the FFT, so neither backend loops over the samples in Python
+    """
+    if BACKEND == "numpy":
+        total = np.zeros(len(values) + 1, dtype=FLOAT)
+        total[1:] = np.cumsum(values)
+        return total[window:window + count] - total[0:count]
+
+    if window not in __ones:
+        __ones[window] = np.ones(window, dtype=FLOAT)
+    n_fft = next_pow2(count + window)
+    return cross_correlate_fft(values[0:count + window - 1], __ones[window], n_fft)[0:count]
+
+
+def sosfilt(sos, values, zi):
+    """
+    Filters `values` with the cascade of biquad sections `sos` (one [b0, b1, b2, 1, a1, a2] row per
+    section), starting from the filter state `zi` (one [z0, z1] row per section)
+
+    Returns: (ndarray, ndarray), the filtered values and the state to start the next block from
+
+    This is ulab's (or SciPy's) sosfilt. NumPy on its own has no recursive filter, so without SciPy it is
+    a transposed direct form II loop in plain Python, which is only meant for running on a computer
+    """
+    if sp is not None:
+        return sp.signal.sosfilt(sos, values, zi=zi)
+
+    output = np.array(values, dtype=FLOAT)
+    state = np.array(zi, dtype=FLOAT)
+    for k in range(len(sos)):
+        b0, b1, b2, a0, a1, a2 = [float(c) for c in sos[k]]
+        z0 = float(state[k][0])
+        z1 = float(state[k][1])
+        for i in range(len(output)):
+            x = float(output[i])
+            y = b0 * x + z0
+            z0 = b1 * x - a1 * y + z1
+            z1 = b2 * x - a2 * y
+            output[i] = y
+        state[k][0] = z0
+        state[k][1] = z1
+    return output, state
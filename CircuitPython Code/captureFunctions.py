@@ -0,0 +1,587 @@
+"""
+Audio capture for the guitar tuner
+
+Every capture source fills a preallocated array('H') of raw 16-bit samples (the same 0-65535 scale as
+AnalogIn.value) in one `read_into(buffer)` call, and keeps track of the time between samples:
+    - BufferedCapture uses analogbufio.BufferedIn, where the ADC itself is clocked at the sample rate
+    - LoopCapture reads AnalogIn.value in a tight loop, for boards without analogbufio (like the Feather M4)
+    - PacedCapture reads one sample at a time on a fixed schedule and timestamps them, and can resample (or
+      throw away) frames whose timing was too uneven
+    - SimulatedCapture makes up a guitar-like signal, so the tuner code can be run on a computer
+
+`get_capture` picks the best one available
+
+The capture sources are read into frames by a framer, either FrameBuffers (separate frames in a few
+buffers, taken in turns), FramePool (like FrameBuffers, but the length of the frames can be changed from
+one frame to the next, see `get_frame_length`) or FrameRing (overlapping frames that share one ring
+buffer, so only the new hop of samples has to be captured for each frame)
+
+None of the pipelines capture all the time, they stop while a frame is being processed, so the framers use
+a GapDetector to tell whether each capture followed straight on from the one before. `is_fresh(frame)`
+tells whether a frame starts over after a gap, so whatever carried on from the last frame (like the state
+of the filters) can be started over too. FrameRing only ever joins hops that followed straight on from
+each other into a frame, and fills a whole frame again after a gap.
+"""
+
+import math
+import random
+import time
+from array import array
+
+from arrayFunctions import np, FLOAT
+
+try:
+    import analogbufio
+except ImportError:
+    analogbufio = None
+
+try:
+    from analogio import AnalogIn
+except ImportError:
+    AnalogIn = None
+
+
+def get_sample_buffer(length):
+    """Returns a preallocated array('H') of `length` raw samples, all 0"""
+    return array('H', [0] * length)
+
+
+class LoopCapture():
+    '''
+    Reads an analog pin as fast as the interpreter can, with nothing but the read and the store in the loop
+    '''
+
+    def __init__(self, pin):
+        """`pin` is the board pin of the audio input, like board.A1"""
+        self.__pin = AnalogIn(pin)
+        self.__sample_period = 0.0
+
+    def read_into(self, buffer):
+        """
+        Fills `buffer` (an array('H') or a memoryview of one) with raw samples
+
+        The sample period is measured over the whole buffer, since it depends on how fast the loop runs
+
+        Returns: int, the number of samples read
+        """
+        pin = self.__pin
+        length = len(buffer)
+        start_time = time.monotonic_ns()
+        for i in range(length):
+            buffer[i] = pin.value
+        end_time = time.monotonic_ns()
+        self.__sample_period = (end_time - start_time) / 1000000000 / length
+        return length
+
+    def get_sample_period(self):
+        """
+        A getter method for the time between samples of the last read
+
+        Returns: float, in seconds
+        """
+        return self.__sample_period
+
+    def get_pin(self):
+        """
+        A getter method for the AnalogIn, so the pin can still be read one value at a time
+
+        Returns: analogio.AnalogIn
+        """
+        return self.__pin
+
+
+class BufferedCapture():
+    '''
+    Reads an analog pin with analogbufio, so the samples are evenly spaced at exactly the sample rate
+    '''
+
+    def __init__(self, pin, sample_rate):
+        """`pin` is the board pin of the audio input, `sample_rate` is in Hz"""
+        self.__input = analogbufio.BufferedIn(pin, sample_rate=sample_rate)
+        self.__sample_period = 1 / sample_rate
+
+    def read_into(self, buffer):
+        """
+        Fills `buffer` (an array('H') or a memoryview of one) with raw samples
+
+        Returns: int, the number of samples read
+        """
+        return self.__input.readinto(buffer)
+
+    def get_sample_period(self):
+        """
+        A getter method for the time between samples
+
+        Returns: float, in seconds
+        """
+        return self.__sample_period
+
+
+class PacedCapture():
+    '''
+    Reads an analog pin one sample at a time on a schedule of `sample_rate` samples per second
+
+    Each sample waits for its own deadline, and the time it was actually taken is recorded. If the loop can't
+    keep up with the sample rate (a read of the pin and a timestamp take longer than a sample period) it
+    just runs as fast as it can, so the sample period is measured over each frame, like LoopCapture does,
+    and is only the one of `sample_rate` while the loop keeps up.
+
+    `get_jitter` compares the timestamps to evenly spaced samples at the measured period. By default frames
+    are kept however uneven they were, a GC pause in the middle of one just gives one bad reading. With
+    `max_jitter` set, a frame with any sample further off than `max_jitter` sample periods is interpolated
+    back onto the even spacing, or with `resample` off, thrown away. Only set it to what the loop can
+    actually hold, or most frames will be.
+    '''
+
+    def __init__(self, pin, sample_rate = 10000, max_jitter = None, resample = True, reader = None):
+        """
+        `pin` is the board pin of the audio input. Instead of a pin, `reader` can be any function that
+        returns one raw sample, like the read_value of a SimulatedCapture
+        """
+        self.__input = None
+        if reader is None:
+            self.__input = AnalogIn(pin)
+        self.__reader = reader
+        self.__sample_period = 1 / sample_rate
+        self.__period_ns = int(1000000000 / sample_rate)
+        self.__max_jitter = max_jitter
+        self.__resample = resample
+
+        self.__timestamps = array('I') #when each sample was taken, in ns from the first one
+        self.__steps = None #0, 1, 2, ... the sample numbers, for spacing the samples evenly
+        self.__rejected = 0
+        self.__resampled = 0
+
+    def __prepare(self, length):
+        """A private method that makes the timestamp and step buffers the right length, only when it changes"""
+        if len(self.__timestamps) != length:
+            self.__timestamps = array('I', [0] * length)
+            self.__steps = np.array(range(length), dtype=FLOAT)
+
+    def __get_error(self):
+        """
+        A private method that compares the timestamps of the last frame to evenly spaced samples
+
+        Returns: (ndarray, ndarray, ndarray), the timestamps, the even spacing and how far apart they are, in ns
+        """
+        times = np.array(self.__timestamps, dtype=FLOAT)
+        even = self.__steps * (self.__sample_period * 1000000000)
+        return times, even, times - even
+
+    def read_into(self, buffer):
+        """
+        Fills `buffer` (an array('H') or a memoryview of one) with raw samples taken on schedule
+
+        Returns: int, the number of samples read, or 0 if the frame was thrown away for being too uneven
+        """
+        length = len(buffer)
+        self.__prepare(length)
+        timestamps = self.__timestamps
+        period = self.__period_ns
+        monotonic_ns = time.monotonic_ns
+
+        # the pin is read straight from the AnalogIn, going through a function would add a call per sample
+        start_time = monotonic_ns()
+        deadline = start_time
+        if self.__input is not None:
+            pin = self.__input
+            for i in range(length):
+                now = monotonic_ns()
+                while now < deadline:
+                    now = monotonic_ns()
+                buffer[i] = pin.value
+                timestamps[i] = now - start_time
+                deadline += period
+        else:
+            read = self.__reader
+            for i in range(length):
+                now = monotonic_ns()
+                while now < deadline:
+                    now = monotonic_ns()
+                buffer[i] = read()
+                timestamps[i] = now - start_time
+                deadline += period
+
+        # the samples are taken to be evenly spaced over the time the frame actually took
+        if length > 1:
+            self.__sample_period = timestamps[length - 1] / (length - 1) / 1000000000
+
+        if self.__max_jitter is not None:
+            times, even, error = self.__get_error()
+            if float(np.max(abs(error))) > self.__max_jitter * self.__sample_period * 1000000000:
+                if not self.__resample:
+                    self.__rejected += 1
+                    return 0
+                # moves every sample to where it would have been if they were evenly spaced
+                values = np.interp(even, times, np.array(buffer, dtype=FLOAT))
+                for i in range(length):
+                    buffer[i] = int(values[i])
+                self.__resampled += 1
+        return length
+
+    def get_sample_period(self):
+        """
+        A getter method for the time between samples of the last read, measured over the whole read
+
+        Returns: float, in seconds
+        """
+        return self.__sample_period
+
+    def get_jitter(self):
+        """
+        Works out how far the samples of the last frame were from being evenly spaced
+
+        Returns: (float, float), the RMS and the largest timing error, in seconds
+        """
+        if self.__steps is None:
+            return (0.0, 0.0)
+        times, even, error = self.__get_error()
+        return (float(np.sqrt(np.mean(error * error))) / 1000000000, float(np.max(abs(error))) / 1000000000)
+
+    def get_timestamps(self):
+        """
+        A getter method for when each sample of the last frame was taken
+
+        Returns: array('I'), in ns from the first sample
+        """
+        return self.__timestamps
+
+    def get_rejected(self):
+        """
+        A getter method for the number of frames thrown away for being too uneven
+
+        Returns: int
+        """
+        return self.__rejected
+
+    def get_resampled(self):
+        """
+        A getter method for the number of frames interpolated back onto even spacing for being too uneven
+
+        Returns: int
+        """
+        return self.__resampled
+
+
+class SimulatedCapture():
+    '''
+    Makes up the signal of a guitar string for running the tuner away from the board
+
+    The signal is a few harmonics of `freq` plus some noise around the middle of the ADC range, and carries
+    on from where the last read left off. With `realtime` on, a read takes as long as the real capture would.
+    '''
+
+    def __init__(self, freq = 110.0, sample_rate = 12500, realtime = False, seed = 0):
+        self.__freq = freq
+        self.__sample_period = 1 / sample_rate
+        self.__realtime = realtime
+        self.__random = random.Random(seed)
+        self.__count = 0 #the number of samples made so far
+
+    def set_freq(self, freq):
+        """Changes the frequency of the simulated string, 0 for silence"""
+        self.__freq = freq
+
+    def read_value(self):
+        """
+        Makes up the next single sample, so the simulation can stand in for AnalogIn.value
+
+        Returns: int, a raw 16-bit sample
+        """
+        phase = 2 * math.pi * self.__freq * self.__sample_period * self.__count
+        value = 0.6 * math.sin(phase) + math.sin(2 * phase) + 0.5 * math.sin(3 * phase) \
+            + 0.3 * math.sin(4 * phase) + self.__random.gauss(0, 0.02)
+        self.__count += 1
+        return min(65535, max(0, int(32768 + 8000 * value)))
+
+    def read_into(self, buffer):
+        """
+        Fills `buffer` (an array('H') or a memoryview of one) with raw samples
+
+        Returns: int, the number of samples read
+        """
+        start_time = time.monotonic_ns()
+        for i in range(len(buffer)):
+            buffer[i] = self.read_value()
+
+        if self.__realtime:
+            remaining = len(buffer) * self.__sample_period - (time.monotonic_ns() - start_time) / 1000000000
+            if remaining > 0:
+                time.sleep(remaining)
+        return len(buffer)
+
+    def get_sample_period(self):
+        """
+        A getter method for the time between samples
+
+        Returns: float, in seconds
+        """
+        return self.__sample_period
+
+
+class GapDetector():
+    '''
+    Tells whether each capture followed straight on from the one before it, from when they started and ended
+
+    A capture follows on if it started no more than `max_gap` sample periods after the last one ended. The
+    end is when its read_into returned, so whatever a capture does before and after its samples (like
+    PacedCapture working out the sample period) doesn't count as a gap, and `max_gap` only has to allow for
+    the few lines the pipeline runs between two reads. A capture that was thrown away breaks the chain too.
+    With `max_gap` None only thrown away captures break it, however long the capture stopped for.
+    '''
+
+    def __init__(self, max_gap = 4.0):
+        self.__max_gap = max_gap
+        self.__end = None #when the last capture ended, in ns
+
+    def update(self, start_time, end_time, sample_period):
+        """
+        Adds a capture that started at `start_time` and ended at `end_time` (both from time.monotonic_ns)
+
+        Returns: bool, True if it followed straight on from the last one
+        """
+        follows = self.__end is not None
+        if follows and self.__max_gap is not None:
+            follows = start_time - self.__end <= self.__max_gap * sample_period * 1000000000
+        self.__end = end_time
+        return follows
+
+    def interrupt(self):
+        """Breaks the chain, so the next capture doesn't follow on whenever it starts"""
+        self.__end = None
+
+
+class FrameBuffers():
+    '''
+    Captures whole frames of `length` samples into `count` preallocated buffers, taking them in turns
+
+    Up to `count` frames can be in use at once (one being captured while the others are being processed)
+    '''
+
+    def __init__(self, length, count = 2, max_gap = 4.0):
+        self.__buffers = [get_sample_buffer(length) for i in range(count)]
+        self.__next = 0
+        self.__gaps = GapDetector(max_gap)
+        self.__fresh = {} #whether each buffer's frame starts over after a gap, by id
+
+    def read(self, capture):
+        """
+        Captures the next frame from `capture` into the next buffer
+
+        Returns: array('H'), the frame, or None if the capture threw it away
+        """
+        frame = self.__buffers[self.__next]
+        start_time = time.monotonic_ns()
+        if capture.read_into(frame) == 0:
+            self.__gaps.interrupt()
+            return None
+        self.__fresh[id(frame)] = not self.__gaps.update(start_time, time.monotonic_ns(),
+                                                         capture.get_sample_period())
+        self.__next = (self.__next + 1) % len(self.__buffers)
+        return frame
+
+    def is_fresh(self, frame):
+        """
+        A getter method for whether `frame` didn't follow straight on from the frame before it
+
+        Returns: bool
+        """
+        return self.__fresh.get(id(frame), True)
+
+    def get_depth(self):
+        """
+        A getter method for how many frames can be in use at once
+
+        Returns: int
+        """
+        return len(self.__buffers)
+
+
+class FramePool():
+    '''
+    Captures frames of a length that can change from frame to frame, from `count` preallocated buffers of
+    `max_length` samples
+
+    A frame is a memoryview of the start of one of the buffers. Lengths are rounded up to a multiple of
+    `step` samples and the views of every length are kept once made, so changing the length doesn't
+    allocate anything after the first time each length is used.
+    '''
+
+    def __init__(self, max_length = 2048, count = 2, min_length = 256, step = 64, max_gap = 4.0):
+        self.__buffers = [get_sample_buffer(max_length) for i in range(count)]
+        self.__views = [{} for i in range(count)] #the views of each buffer, keyed by length
+        self.__min_length = min_length
+        self.__max_length = max_length
+        self.__step = step
+        self.__length = max_length
+        self.__next = 0
+        self.__gaps = GapDetector(max_gap)
+        self.__fresh = {} #whether each view's frame starts over after a gap, by id
+
+    def set_length(self, length):
+        """Sets the length of the next frames, rounded up to a multiple of `step` and kept within the bounds"""
+        length = -(-int(length) // self.__step) * self.__step
+        self.__length = min(self.__max_length, max(self.__min_length, length))
+
+    def read(self, capture):
+        """
+        Captures the next frame from `capture` into the next buffer
+
+        Returns: memoryview, the frame, or None if the capture threw it away
+        """
+        views = self.__views[self.__next]
+        length = self.__length
+        if length not in views:
+            views[length] = memoryview(self.__buffers[self.__next])[0:length]
+        frame = views[length]
+        start_time = time.monotonic_ns()
+        if capture.read_into(frame) == 0:
+            self.__gaps.interrupt()
+            return None
+        self.__fresh[id(frame)] = not self.__gaps.update(start_time, time.monotonic_ns(),
+                                                         capture.get_sample_period())
+        self.__next = (self.__next + 1) % len(self.__buffers)
+        return frame
+
+    def is_fresh(self, frame):
+        """
+        A getter method for whether `frame` didn't follow straight on from the frame before it
+
+        Returns: bool
+        """
+        return self.__fresh.get(id(frame), True)
+
+    def get_length(self):
+        """
+        A getter method for the length of the next frames
+
+        Returns: int
+        """
+        return self.__length
+
+    def get_depth(self):
+        """
+        A getter method for how many frames can be in use at once
+
+        Returns: int
+        """
+        return len(self.__buffers)
+
+
+class FrameRing():
+    '''
+    Overlapping frames of `length` samples where a new frame starts every `hop` samples
+
+    Each read only captures the `hop` new samples, straight into a ring buffer, and the frame is a memoryview
+    of the ring, so the rest of it is reused without being copied. The ring is stored twice in a row and
+    each hop is written to both copies, so any frame is one contiguous view no matter where it starts.
+
+    The ring has room for one hop more than a frame, so the next hop can be captured while the last frame
+    is still being processed.
+
+    Hops are only joined into a frame if each one followed straight on from the one before (within
+    `max_gap` sample periods, see GapDetector). After a gap, or a hop the capture threw away, the ring is
+    filled with a whole frame of new hops again before the next frame comes out, so a frame never has a gap
+    in the middle of it. That first frame after a gap is fresh (see `is_fresh`).
+    '''
+
+    def __init__(self, length = 2048, hop = 512, max_gap = 4.0):
+        if length % hop != 0:
+            raise ValueError("The frame length has to be a multiple of the hop size")
+        capacity = length + hop
+        slots = capacity // hop
+        self.__buffer = get_sample_buffer(2 * capacity)
+
+        # all the views are made once here, so reading a frame doesn't allocate anything
+        view = memoryview(self.__buffer)
+        self.__hops = [view[k * hop:(k + 1) * hop] for k in range(slots)]
+        self.__mirrors = [view[capacity + k * hop:capacity + (k + 1) * hop] for k in range(slots)]
+        self.__frames = []
+        for k in range(slots):
+            oldest = (k - length // hop + 1) % slots
+            self.__frames.append(view[oldest * hop:oldest * hop + length])
+
+        self.__slot = 0 #the slot the next hop goes into
+        self.__length = length
+        self.__hop = hop
+        self.__hops_needed = length // hop #hops left to capture before the next full frame
+        self.__gaps = GapDetector(max_gap)
+        self.__fresh = [True] * slots #whether the frame ending at each slot is the first one after a gap
+
+    def read(self, capture):
+        """
+        Captures the next hop of samples from `capture` into the ring
+
+        Returns: memoryview, the frame ending with the new hop, or None if the capture threw the hop away or
+        there aren't enough samples that followed on from each other for a full frame yet
+        """
+        slot = self.__slot
+        start_time = time.monotonic_ns()
+        if capture.read_into(self.__hops[slot]) == 0:
+            self.__gaps.interrupt()
+            return None
+        if not self.__gaps.update(start_time, time.monotonic_ns(), capture.get_sample_period()):
+            # the capture stopped since the last hop, so the frame starts over from this one
+            self.__hops_needed = self.__length // self.__hop
+        self.__mirrors[slot][:] = self.__hops[slot]
+        self.__slot = (slot + 1) % len(self.__hops)
+
+        fresh = False
+        if self.__hops_needed > 0:
+            self.__hops_needed -= 1
+            if self.__hops_needed > 0:
+                return None
+            fresh = True
+        self.__fresh[slot] = fresh
+        return self.__frames[slot]
+
+    def is_fresh(self, frame):
+        """
+        A getter method for whether `frame` is the first frame after a gap, so it doesn't overlap the frame
+        before it
+
+        Returns: bool
+        """
+        for slot in range(len(self.__frames)):
+            if self.__frames[slot] is frame:
+                return self.__fresh[slot]
+        return True
+
+    def get_depth(self):
+        """
+        A getter method for how many frames can be in use at once
+
+        Returns: int
+        """
+        return 2
+
+
+def get_frame_length(freq, time_delta, periods = 8, min_length = 256, max_length = 2048):
+    """
+    Returns the number of samples that holds `periods` periods of `freq` Hz, within the bounds
+
+    When there is no pitch yet (`freq` is 0) it's `max_length`, so any string can be detected. Then a high
+    string gets short frames that come often, and a low string longer ones that give steadier readings
+    """
+    if freq <= 0:
+        return max_length
+    return min(max_length, max(min_length, int(periods / (freq * time_delta))))
+
+
+def get_capture(pin = None, sample_rate = 12500, paced = False):
+    """
+    Returns the best capture source for `pin` on this board
+
+    analogbufio if the board has it, a tight AnalogIn loop if it doesn't, or a simulated guitar if there
+    is no analogio at all (on a computer). The loop runs as fast as it can, unless `paced` is True, in which
+    case it is a PacedCapture at `sample_rate` (also around the simulated guitar on a computer)
+    """
+    if analogbufio is not None:
+        return BufferedCapture(pin, sample_rate)
+    if AnalogIn is not None:
+        if paced:
+            return PacedCapture(pin, sample_rate)
+        return LoopCapture(pin)
+    if paced:
+        return PacedCapture(pin, sample_rate, reader=SimulatedCapture(sample_rate=sample_rate).read_value)
+    return SimulatedCapture(sample_rate=sample_rate)
@@ -0,0 +1,459 @@
+"""
+Autocorrelation engines and peak finding for the guitar tuner's pitch detection
+
+The correlation used by Tuner.py slides a small cutout (the template) of the waveform along the whole
+waveform and records how well they overlap at every timeshift/lag. The distance between the peaks of
+that correlation is the period of the waveform.
+
+Two engines compute it:
+    - ENGINE_CONVOLVE convolves the wave with the flipped template directly, which is O(N*M)
+    - ENGINE_FFT zero pads the wave and the template, multiplies the spectrum of the wave by the conjugate
+      spectrum of the template (the cross power spectrum) and transforms it back, which is O(N log N).
+      For the wave against itself this is the power spectrum of the Wiener-Khinchin theorem.
+
+Both return an array whose absolute max is at lag 0, followed by the correlation for positive lags,
+so the same peak finding works on either one.
+
+When only a handful of lags are needed (see `correlate_lags`), ENGINE_DOT computes each one as a single
+dot product of the template with the wave, which is O(lags*M).
+"""
+
+from arrayFunctions import np, FLOAT, as_float, next_pow2, cumsum, cross_correlate_fft
+
+ENGINE_CONVOLVE = "convolve"
+ENGINE_FFT = "fft"
+ENGINE_DOT = "dot"
+ENGINES = (ENGINE_CONVOLVE, ENGINE_FFT, ENGINE_DOT)
+
+# The band of frequencies the tuner displays, 2.5 half-steps below the low E string and above the high E string
+GUITAR_LOW = 71.326
+GUITAR_HIGH = 380.836
+
+# Lag windows from `lag_bounds`, keyed by (sample period, low, high)
+__lag_bounds = {}
+
+# Anti-aliasing filters for `decimate`, keyed by the decimation factor
+__decimation_taps = {}
+
+
+def correlate_convolve(uwave, template_size = 512):
+    """
+    The original correlation from Tuner.py, convolves the whole wave against the flipped first
+    `template_size` samples
+
+    Returns len(uwave) + template_size - 1 values, with lag 0 at index template_size - 1
+    """
+    return np.convolve(uwave, np.flip(uwave[0:template_size]))
+
+
+def correlate_fft(uwave, template_size = 512):
+    """
+    Computes the same correlation as `correlate_convolve` through a zero padded FFT
+
+    The wave is padded to at least len(uwave) + template_size samples so the circular correlation from
+    the FFT doesn't wrap around. Only the lags where the template fully overlaps the wave are kept,
+    the negative lags of the convolution are left out since the peak finding never looks at them.
+
+    Returns len(uwave) - template_size + 1 values, with lag 0 at index 0
+    """
+    lags = len(uwave) - template_size + 1
+    n_fft = next_pow2(len(uwave) + template_size)
+    return cross_correlate_fft(uwave, uwave[0:template_size], n_fft)[0:lags]
+
+
+def correlate(wave, engine = ENGINE_CONVOLVE, template_size = 512):
+    """
+    Computes the correlation of `wave` (a list or array of samples) with the selected engine
+
+    `engine` is either ENGINE_CONVOLVE or ENGINE_FFT
+    """
+    uwave = as_float(wave)
+    if engine == ENGINE_FFT:
+        return correlate_fft(uwave, template_size)
+    if engine == ENGINE_CONVOLVE:
+        return correlate_convolve(uwave, template_size)
+    raise ValueError("Unknown correlation engine: " + str(engine))
+
+
+def walk_peaks(correlation, threshold = 0.91):
+    """
+    The original peak finding loops from get_freq_correlation, kept as the reference for `pick_peaks`
+
+    Finds the distance (in samples) between the absolute max of `correlation` and the next peak
+
+    Starting at the absolute max it walks through the array until it leaves the first peak, waits until
+    it registers another peak (anything above `threshold` times the max), and then records that whole peak
+    to find its exact location.
+
+    Returns 0 if the end of the correlation is reached before a second full peak is found
+    """
+    match = np.max(correlation)
+    match_location = int(np.argmax(correlation))
+    length = len(correlation)
+
+    local_max = []
+    count = 0
+
+    # leaves the first peak
+    while correlation[match_location + count] >= (match * threshold):
+        count += 1
+        if (match_location + count) == length:
+            return 0
+
+    # waits for the next peak
+    while correlation[match_location + count] < (match * threshold):
+        count += 1
+        if (match_location + count) == length:
+            return 0
+    start = count
+
+    # records the next peak until it leaves the threshold
+    while correlation[match_location + count] >= (match * threshold):
+        local_max.append(correlation[match_location + count])
+        count += 1
+        if (match_location + count) == length:
+            return 0
+
+    return start + int(np.argmax(np.array(local_max)))
+
+
+def pick_peaks(correlation, threshold = 0.91):
+    """
+    Array version of `walk_peaks`, gives the same result without looping over the samples in Python
+
+    Everything from the absolute max on is thresholded into a mask of 1s (above `threshold` times the max)
+    and 0s. The diff of that mask is 1 where a peak starts and -1 right before one ends, and since the mask
+    starts on the first peak, the first 1 is the start of the second peak and the first -1 after it is its end.
+    The exact location is the argmax inside that segment.
+
+    Returns 0 if the correlation ends before a second full peak is found
+    """
+    match_location = int(np.argmax(correlation))
+    tail = correlation[match_location:]
+    above = np.array(tail >= np.max(correlation) * threshold, dtype=np.int8)
+    edges = np.diff(above)
+    if len(edges) == 0:
+        return 0
+
+    rise = int(np.argmax(edges))
+    if edges[rise] != 1:
+        return 0
+    start = rise + 1
+    if start >= len(edges):
+        return 0
+
+    end = int(np.argmin(edges[start:])) + start
+    if edges[end] != -1:
+        return 0
+
+    return start + int(np.argmax(tail[start:end + 1]))
+
+
+def parabolic_offset(before, peak, after):
+    """
+    Fits a parabola through three neighbouring values and returns where its vertex is relative
+    to the middle one, somewhere between -0.5 and 0.5
+
+    Works for both peaks and valleys, and returns 0 if the three values are in a straight line
+    """
+    curve = before - 2 * peak + after
+    if curve == 0:
+        return 0.0
+    return 0.5 * (before - after) / curve
+
+
+def lag_bounds(time_delta, low = GUITAR_LOW, high = GUITAR_HIGH):
+    """
+    Returns the (min_lag, max_lag) in samples that cover frequencies from `low` to `high` Hz
+
+    The sample period only changes by a tiny bit between frames, so the bounds are worked out once
+    per period (to the nearest tenth of a microsecond) and reused
+    """
+    key = (round(time_delta * 10000000), low, high)
+    if key not in __lag_bounds:
+        __lag_bounds[key] = (max(1, int(1 / (high * time_delta))), int(1 / (low * time_delta)) + 1)
+    return __lag_bounds[key]
+
+
+def correlate_lags(uwave, min_lag, max_lag, engine = ENGINE_FFT, template_size = 512):
+    """
+    Computes the correlation of the template (the first `template_size` samples) with the wave for only the
+    lags from min_lag to max_lag, plus one extra lag on either side for interpolating the peak
+
+    Only the part of the wave those lags can reach is used, so the unused lags cost nothing. The template is
+    shortened if the frame is too short for it to reach max_lag.
+
+    Returns max_lag - min_lag + 3 values, starting at lag min_lag - 1, and the correlation at lag 0
+    """
+    low = max(0, min_lag - 1)
+    high = max_lag + 1
+    template_size = min(template_size, len(uwave) - high)
+    template = uwave[0:template_size]
+    segment = uwave[low:high + template_size]
+    count = high - low + 1
+
+    if engine == ENGINE_FFT:
+        correlation = cross_correlate_fft(segment, template, next_pow2(len(segment)))[0:count]
+    elif engine == ENGINE_DOT:
+        correlation = np.zeros(count, dtype=FLOAT)
+        for i in range(count):
+            correlation[i] = np.dot(template, segment[i:i + template_size])
+    elif engine == ENGINE_CONVOLVE:
+        correlation = np.convolve(segment, np.flip(template))[template_size - 1:template_size - 1 + count]
+    else:
+        raise ValueError("Unknown correlation engine: " + str(engine))
+    return correlation, np.dot(template, template)
+
+
+def __peak_height(correlation, index):
+    """Just a private method that returns the height of the parabola fitted through a peak"""
+    before = correlation[index - 1]
+    after = correlation[index + 1]
+    return correlation[index] - 0.25 * (before - after) * parabolic_offset(before, correlation[index], after)
+
+
+def pick_band_peak(correlation, first_lag, energy, threshold = 0.91, min_clarity = 0.3):
+    """
+    Picks the period (in samples, with sub-sample precision) out of a correlation from `correlate_lags`
+
+    The highest point in the band is found with argmax. Because every multiple of the period is a peak too,
+    the lags at a half, third and quarter of it are checked, and the shortest one that is still above
+    `threshold` times the highest point is used. The heights are compared at the interpolated tops of the
+    peaks, since a short period can fall between two samples and look lower than it is. The peak is then refined with parabolic interpolation.
+
+    Returns 0 if the highest point is at the edge of the band (so there's no peak inside it), or if it is
+    below `min_clarity` times the correlation at lag 0 (so the wave isn't periodic)
+    """
+    last = len(correlation) - 2
+    best = int(np.argmax(correlation[1:last + 1])) + 1
+    peak = correlation[best]
+    if best == 1 or best == last or peak < min_clarity * energy:
+        return 0
+
+    peak = __peak_height(correlation, best)
+    for divisor in (4, 3, 2):
+        guess = int((best + first_lag) / divisor + 0.5) - first_lag
+        if guess < 2 or guess > last - 1:
+            continue
+        nearby = guess - 1 + int(np.argmax(correlation[guess - 1:guess + 2]))
+        # only counts if it is the top of a peak and not just the side of one
+        if correlation[nearby] < correlation[nearby - 1] or correlation[nearby] < correlation[nearby + 1]:
+            continue
+        if __peak_height(correlation, nearby) >= threshold * peak:
+            best = nearby
+            break
+
+    offset = parabolic_offset(correlation[best - 1], correlation[best], correlation[best + 1])
+    return best + first_lag + offset
+
+
+def get_lag_band(wave, time_delta, engine = ENGINE_FFT, template_size = 512, threshold = 0.91,
+                 low = GUITAR_LOW, high = GUITAR_HIGH):
+    """
+    Band-limited version of correlate + pick_peaks, only the lags for frequencies from `low` to `high`
+    are computed and searched
+
+    Returns the period in samples, or 0 if there is no pitch in the band
+    """
+    min_lag, max_lag = lag_bounds(time_delta, low, high)
+    correlation, energy = correlate_lags(as_float(wave), min_lag, max_lag, engine, template_size)
+    return pick_band_peak(correlation, max(0, min_lag - 1), energy, threshold)
+
+
+def decimate(uwave, factor = 4):
+    """
+    Low-pass filters and downsamples `uwave` by `factor` as a polyphase filter
+
+    The anti-aliasing filter is a triangle 2*factor - 1 taps long (two boxcar averages in a row). Rather than
+    filtering every sample and throwing most of them away, each tap multiplies a strided slice of the wave,
+    so only the kept output samples are ever computed, with one array operation per tap.
+    """
+    if factor not in __decimation_taps:
+        __decimation_taps[factor] = [(factor - abs(k - factor + 1)) / (factor * factor)
+                                     for k in range(2 * factor - 1)]
+    taps = __decimation_taps[factor]
+
+    count = (len(uwave) - len(taps)) // factor + 1
+    stop = factor * (count - 1) + 1
+    decimated = taps[0] * uwave[0:stop:factor]
+    for k in range(1, len(taps)):
+        decimated += taps[k] * uwave[k:k + stop:factor]
+    return decimated
+
+
+def get_lag_multirate(wave, time_delta, factor = 4, engine = ENGINE_FFT, template_size = 512,
+                      threshold = 0.91, low = GUITAR_LOW, high = GUITAR_HIGH):
+    """
+    Coarse to fine version of `get_lag_band`
+
+    The period is first found on a copy of the wave decimated by `factor`, where the correlation is about
+    factor^2 cheaper (a factor shorter wave and template). Then only the full rate lags within a coarse
+    sample of that period are computed, with one dot product each, and the peak is refined from those.
+
+    Returns the period in samples at the full rate, or 0 if there is no pitch in the band
+    """
+    uwave = as_float(wave)
+    coarse_lag = get_lag_band(decimate(uwave, factor), time_delta * factor, engine,
+                              template_size // factor, threshold, low, high)
+    if coarse_lag == 0:
+        return 0
+
+    center = int(coarse_lag * factor + 0.5)
+    min_lag = max(2, center - factor - 1)
+    correlation, energy = correlate_lags(uwave, min_lag, center + factor + 1, ENGINE_DOT, template_size)
+    return pick_band_peak(correlation, min_lag - 1, energy, threshold)
+
+
+class StreamingCorrelator():
+    '''
+    Keeps the correlation of the most recent `window` samples up to date as new samples come in
+
+    Instead of recomputing the whole correlation every frame, each push adds the products of the new samples
+    with the samples before them and subtracts the products of the samples that just left the window.
+    That costs O(hop * lags) per push instead of O(N * M), so a reading can be taken every hop.
+
+    Every lag of the correlation is a sum over the same number of samples (the window). Since a plucked
+    string gets quieter, the older samples at long lags can outweigh lag 0, so the frequency is found on
+    the normalized correlation, which is exactly 1 at lag 0 and at most 1 everywhere else.
+    '''
+
+    def __init__(self, window = 2048, max_lag = 256, hop = 256, refresh = 64):
+        """
+        `window` is the number of samples the correlation covers, `max_lag` the number of lags kept and
+        `hop` the most samples a single push can take. The correlation is recomputed from scratch every
+        `refresh` pushes so the rounding errors from adding and subtracting don't build up
+        """
+        self.__window = window
+        self.__max_lag = max_lag
+        self.__hop = hop
+        self.__refresh = refresh
+
+        # The ring buffer is written twice, once at each half, so any span of it can be read
+        # as one contiguous slice without copying
+        self.__capacity = window + max_lag + hop
+        self.__buffer = np.zeros(2 * self.__capacity, dtype=FLOAT)
+        self.__total = 0 #the number of samples pushed so far
+        self.__pushes = 0
+        self.__dc = None #the running estimate of the DC offset that is removed from the samples
+
+        self.__correlation = np.zeros(max_lag, dtype=FLOAT)
+
+    def __span(self, start, length):
+        """
+        A private method that returns the `length` samples starting at sample number `start` as a view
+
+        Samples from before the first push (negative numbers) read as zeros
+        """
+        position = start % self.__capacity
+        return self.__buffer[position:position + length]
+
+    def __write(self, block):
+        """A private method that copies `block` into both halves of the ring buffer"""
+        position = self.__total % self.__capacity
+        first = min(len(block), self.__capacity - position)
+        for offset in (0, self.__capacity):
+            self.__buffer[offset + position:offset + position + first] = block[0:first]
+            if first < len(block):
+                self.__buffer[offset:offset + len(block) - first] = block[first:]
+
+    def __products(self, start, length):
+        """
+        A private method that returns, for every lag, the sum of x[k] * x[k - lag] over the `length` samples
+        starting at sample number `start`
+        """
+        lags = self.__max_lag
+        span = self.__span(start - lags + 1, length + lags - 1)
+        block = span[lags - 1:]
+        return np.flip(np.convolve(span, np.flip(block))[length - 1:length + lags - 1])
+
+    def push(self, block):
+        """
+        Adds the samples in `block` (at most `hop` of them) and updates the correlation
+
+        The DC offset of the signal is tracked and removed as the samples come in, so raw voltages can be
+        pushed directly
+        """
+        block = as_float(block)
+        length = len(block)
+        if length > self.__hop:
+            raise ValueError("Can't push more than " + str(self.__hop) + " samples at once")
+
+        mean = np.mean(block)
+        if self.__dc is None:
+            self.__dc = mean
+        else:
+            self.__dc += (mean - self.__dc) * 0.25
+        self.__write(block - self.__dc)
+
+        start = self.__total
+        self.__total += length
+        self.__pushes += 1
+
+        if self.__pushes % self.__refresh == 0:
+            self.__correlation = self.__products(self.__total - self.__window, self.__window)
+            return
+
+        self.__correlation += self.__products(start, length)
+        if start - self.__window + length > 0:
+            self.__correlation -= self.__products(start - self.__window, length)
+
+    def reset(self):
+        """Forgets every sample pushed so far, for when the next block doesn't follow on from the last one"""
+        self.__buffer[:] = 0.0
+        self.__correlation[:] = 0.0
+        self.__total = 0
+        self.__pushes = 0
+        self.__dc = None
+
+    def is_full(self):
+        """Returns True once a whole window of samples has been pushed"""
+        return self.__total >= self.__window
+
+    def get_correlation(self):
+        """
+        A getter method for the correlation of the current window
+
+        Returns: array, the correlation for lags 0 to max_lag - 1
+        """
+        return self.__correlation
+
+    def __tail_energy(self, end):
+        """
+        A private method that returns, for every lag, the energy of the `lag` samples just before
+        sample number `end`
+        """
+        lags = self.__max_lag
+        span = self.__span(end - lags + 1, lags - 1)
+        energy = np.zeros(lags, dtype=FLOAT)
+        energy[1:] = cumsum(np.flip(span * span))
+        return energy
+
+    def get_normalized(self):
+        """
+        Returns the correlation divided by the mean energy of the two parts of the signal being compared
+        at each lag, the window itself and the window shifted back by that lag
+
+        The shifted energies are the window energy (lag 0 of the correlation) minus the newest samples plus
+        the samples just before the window, so only two short running sums are needed for them
+        """
+        energy = self.__correlation[0]
+        if energy <= 0:
+            return np.zeros(self.__max_lag, dtype=FLOAT)
+        shifted = self.__tail_energy(self.__total - self.__window) - self.__tail_energy(self.__total)
+        return self.__correlation / (energy + shifted * 0.5)
+
+    def get_freq(self, time_delta, threshold = 0.91):
+        """
+        Finds the frequency of the current window the same way get_freq_correlation in Tuner.py does,
+        with the peak refined by parabolic interpolation
+
+        Returns 0.0 until the window is full, or if no second peak was found
+        """
+        if not self.is_full():
+            return 0.0
+        correlation = self.get_normalized()
+        lag = pick_peaks(correlation, threshold)
+        if lag == 0 or lag + 1 >= len(correlation):
+            return 0.0
+        lag += parabolic_offset(correlation[lag - 1], correlation[lag], correlation[lag + 1])
+        return float(1 / (lag * time_delta))
@@ -0,0 +1,108 @@
+"""
+Signal conditioning for the guitar tuner
+
+Instead of center() in Tuner.py, which averages each frame on its own, the samples go through a streaming
+filter chain that keeps its state from one block to the next:
+    - a one-pole DC blocker, which takes out the ~1.65 V offset of the audio input
+    - a biquad band-pass over the range of the open strings (70 to 400 Hz by default), which takes out the
+      rumble below the low E and the upper harmonics and noise that confuse the pitch detection
+
+Both are second-order sections run by sosfilt in arrayFunctions, so the whole chain is one call per block
+on the board (ulab) as well as on a computer (NumPy)
+"""
+
+import math
+
+from arrayFunctions import np, FLOAT, as_float, sosfilt
+
+
+def design_dc_blocker(sample_rate, cutoff = 10.0):
+    """
+    Returns the section [b0, b1, b2, 1, a1, a2] of the DC blocker y[n] = x[n] - x[n - 1] + r * y[n - 1]
+
+    `r` is set so the blocker cuts off around `cutoff` Hz, well below the lowest string
+    """
+    r = math.exp(-2 * math.pi * cutoff / sample_rate)
+    return [1.0, -1.0, 0.0, 1.0, -r, 0.0]
+
+
+def design_band_pass(sample_rate, low = 70.0, high = 400.0):
+    """
+    Returns the section [b0, b1, b2, 1, a1, a2] of a biquad band-pass from `low` to `high` Hz
+
+    This is the band-pass of the Audio EQ Cookbook (with a peak gain of 1), centered on the geometric mean
+    of the band edges, with the bandwidth in octaves between them
+    """
+    center = math.sqrt(low * high)
+    w0 = 2 * math.pi * center / sample_rate
+    octaves = math.log(high / low, 2)
+    alpha = math.sin(w0) * math.sinh(math.log(2) / 2 * octaves * w0 / math.sin(w0))
+    a0 = 1 + alpha
+    return [alpha / a0, 0.0, -alpha / a0, 1.0, -2 * math.cos(w0) / a0, (1 - alpha) / a0]
+
+
+class SignalConditioner():
+    '''
+    Runs blocks of samples through the DC blocker and band-pass, and keeps the last `length` filtered
+    samples as the frame to analyze
+
+    Each call to `push` only filters the new block, carrying the filter state over from the last one, so
+    it works the same whether the blocks are whole frames or just the new hop of an overlapping frame.
+    The frame is a preallocated array that is shifted along and written in place.
+    '''
+
+    def __init__(self, sample_rate, length = 2048, low = 70.0, high = 400.0):
+        self.__sos = np.array([design_dc_blocker(sample_rate), design_band_pass(sample_rate, low, high)],
+                              dtype=FLOAT)
+        self.__state = np.zeros((2, 2), dtype=FLOAT)
+        self.__frame = np.zeros(length, dtype=FLOAT)
+        self.__block = np.zeros(0, dtype=FLOAT) #the last block converted to floats, reused when the length is the same
+
+    def __as_block(self, block):
+        """A private method that converts `block` to floats in a buffer that is kept between calls"""
+        if isinstance(block, np.ndarray) and block.dtype == FLOAT:
+            return block
+        if len(self.__block) != len(block):
+            self.__block = np.zeros(len(block), dtype=FLOAT)
+        if isinstance(block, np.ndarray):
+            self.__block[:] = block
+        else:
+            self.__block[:] = as_float(block)
+        return self.__block
+
+    def push(self, block):
+        """
+        Filters `block` (a list, array('H'), memoryview or ndarray of samples, at any scale) and adds it to
+        the end of the frame
+
+        Returns: ndarray, the last `length` filtered samples
+        """
+        filtered, self.__state = sosfilt(self.__sos, self.__as_block(block), self.__state)
+        frame = self.__frame
+        count = len(filtered)
+        if count >= len(frame):
+            frame[:] = filtered[count - len(frame):]
+        else:
+            frame[0:len(frame) - count] = frame[count:]
+            frame[len(frame) - count:] = filtered
+        return frame
+
+    def reset(self, level = 0.0):
+        """
+        Clears the filter state and the frame, for when the input has a gap in it
+
+        The DC blocker starts as if the input had been at `level` all along (the DC offset of the input, in
+        its units), so it doesn't take tens of milliseconds to settle from 0 to the offset
+        """
+        self.__state = np.zeros((2, 2), dtype=FLOAT)
+        # the steady state of the transposed direct form II DC blocker with a constant input
+        self.__state[0, 0] = -level
+        self.__frame[:] = 0.0 #in place, since other things can hold views of the frame
+
+    def get_frame(self):
+        """
+        A getter method for the last `length` filtered samples
+
+        Returns: ndarray
+        """
+        return self.__frame
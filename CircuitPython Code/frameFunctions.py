@@ -0,0 +1,178 @@
+"""
+Frame processing with preallocated buffers for the guitar tuner
+
+On the Feather (192 KB of RAM) every array made while processing a frame is garbage by the next one, and
+sooner or later the garbage collector stops everything to clean it up. A FrameContext owns all the buffers
+the processing of a frame needs, made once when it is created and reused for every frame:
+    - the samples, the last frame of filtered samples (kept by its SignalConditioner)
+    - the template, the first `template_size` samples of the frame
+    - the correlation of the template against the frame over the band of lags of the guitar
+    - the views of the frame at every one of those lags, the scratch space of the correlation
+
+It also measures how many bytes each frame allocated, so anything that starts allocating on the hot path
+shows up straight away
+"""
+
+import gc
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+from arrayFunctions import np, FLOAT
+from correlationFunctions import GUITAR_LOW, GUITAR_HIGH, ENGINE_FFT, lag_bounds, correlate_lags, pick_band_peak
+from filterFunctions import SignalConditioner
+
+
+class FrameContext():
+    '''
+    Filters, correlates and finds the pitch of frames of `length` samples at `sample_rate`, using only
+    buffers made when it is created
+
+    The correlation is worked out one lag at a time as the dot product of the template with a view of the
+    frame. The views are all made up front and the frame is always updated in place, so they always see the
+    newest samples. Only a frame that is shorter than `length` (from FramePool) is correlated on its own
+    with correlate_lags, which allocates its own arrays. With `track` on, the bytes allocated by each frame are measured (with gc.mem_alloc on the
+    board, or tracemalloc on a computer). On the board a frame that a collection ran in counts as 0.
+    '''
+
+    def __init__(self, length, sample_rate, template_size = 512, low = GUITAR_LOW, high = GUITAR_HIGH,
+                 track = True):
+        self.__conditioner = SignalConditioner(sample_rate, length, low, high)
+        samples = self.__conditioner.get_frame()
+        self.__time_delta = 1 / sample_rate
+
+        # the lags from min_lag - 1 to max_lag + 1, the extra ones on each side are for the interpolation
+        min_lag, max_lag = lag_bounds(self.__time_delta, low, high)
+        self.__min_lag = min_lag
+        self.__max_lag = max_lag
+        self.__first_lag = max(0, min_lag - 1)
+        last_lag = max_lag + 1
+        template_size = min(template_size, length - last_lag)
+        if template_size <= 0:
+            raise ValueError("A frame of " + str(length) + " samples is too short for lags up to " + str(last_lag))
+
+        self.__template_size = template_size
+        self.__template = samples[0:template_size]
+        self.__views = [samples[lag:lag + template_size] for lag in range(self.__first_lag, last_lag + 1)]
+        self.__correlation = np.zeros(len(self.__views), dtype=FLOAT)
+
+        self.__track = track
+        if track and tracemalloc is not None and not tracemalloc.is_tracing():
+            tracemalloc.start()
+        self.__allocated = 0
+        self.__max_allocated = 0
+
+    def __start_tracking(self):
+        """A private method that notes the memory in use before a frame"""
+        if tracemalloc is not None:
+            tracemalloc.reset_peak()
+            return tracemalloc.get_traced_memory()[0]
+        # the garbage collector is left on, switching it off would make a full heap a MemoryError
+        return gc.mem_alloc()
+
+    def __stop_tracking(self, before):
+        """A private method that works out the bytes allocated since `__start_tracking`"""
+        if tracemalloc is not None:
+            allocated = tracemalloc.get_traced_memory()[1] - before
+        else:
+            # if a collection ran during the frame it freed more than was allocated, and the count is lost
+            allocated = max(0, gc.mem_alloc() - before)
+        self.__allocated = allocated
+        self.__max_allocated = max(self.__max_allocated, allocated)
+
+    def correlate(self):
+        """
+        Works out the correlation of the template with the current frame for every lag in the band, in place
+
+        Returns: (ndarray, float), the correlation (starting at lag min_lag - 1) and the correlation at lag 0
+        """
+        template = self.__template
+        correlation = self.__correlation
+        views = self.__views
+        for i in range(len(views)):
+            correlation[i] = np.dot(template, views[i])
+        return correlation, np.dot(template, template)
+
+    def get_freq_band(self, threshold = 0.91, time_delta = None, length = None):
+        """
+        Finds the frequency of the current frame (or only its last `length` samples) with the band-limited
+        correlation
+
+        `time_delta` is the time between the samples the frame was actually captured at, if it isn't exactly
+        the one of `sample_rate` (the lags searched are still the ones worked out from `sample_rate`)
+
+        Returns: float, in Hz, or 0.0 if there is no pitch in the band (or `length` is too short for the band)
+        """
+        if time_delta is None:
+            time_delta = self.__time_delta
+        samples = self.__conditioner.get_frame()
+        if length is None or length >= len(samples):
+            correlation, energy = self.correlate()
+        else:
+            # the samples before the last `length` are left over from older frames (or zeros after a reset),
+            #   so the template is taken from the start of the tail instead
+            if length <= self.__max_lag + 1:
+                return 0.0
+            correlation, energy = correlate_lags(samples[len(samples) - length:], self.__min_lag, self.__max_lag,
+                                                 ENGINE_FFT, self.__template_size)
+        lag = pick_band_peak(correlation, self.__first_lag, energy, threshold)
+        if lag == 0:
+            return 0.0
+        return float(1 / (lag * time_delta))
+
+    def process(self, block, time_delta = None, detector = None, length = None):
+        """
+        Filters the new samples in `block` into the frame and finds its frequency
+
+        `detector` is any of the pitch detectors (see pitchFunctions), which is given the filtered frame (or
+        only its last `length` samples) and `time_delta`. Without one the frame's own band-limited correlation
+        is used, which is the one that works in the preallocated buffers (unless `length` is shorter than the
+        frame).
+
+        Returns: float, the frequency in Hz, or 0.0 if none was found
+        """
+        if self.__track:
+            before = self.__start_tracking()
+        samples = self.__conditioner.push(block)
+        if detector is None:
+            freq = self.get_freq_band(0.91, time_delta, length)
+        else:
+            if length is not None and length < len(samples):
+                samples = samples[len(samples) - length:]
+            freq = detector(samples, time_delta)
+        if self.__track:
+            self.__stop_tracking(before)
+        return freq
+
+    def reset(self, level = 0.0):
+        """
+        Clears the filters and the frame, so the next block starts from scratch, with the DC blocker
+        already settled on `level` (see SignalConditioner.reset)
+        """
+        self.__conditioner.reset(level)
+
+    def get_samples(self):
+        """
+        A getter method for the filtered frame
+
+        Returns: ndarray
+        """
+        return self.__conditioner.get_frame()
+
+    def get_allocated(self):
+        """
+        A getter method for the bytes allocated while processing the last frame (0 if `track` is off)
+
+        Returns: int
+        """
+        return self.__allocated
+
+    def get_max_allocated(self):
+        """
+        A getter method for the most bytes any one frame has allocated so far
+
+        Returns: int
+        """
+        return self.__max_allocated
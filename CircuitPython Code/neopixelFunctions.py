@@ -5,8 +5,20 @@ A variety of basic functions for Adafruits neopixel,
 Specificly this is for the 24 LED ring
 
 A color will always be represented by a tuple of 3 values 0-255 which represent the Red, Green, and Blue component of the color
+
+A FrameBuffer can be drawn on instead of the ring, to send everything drawn in a frame with a single show()
+
+Colors that get drawn over and over can be added to the palette instead, which checks them once and gives back
+a handle that can be passed as the color to any of the functions in here
+
+The colors of gradients are only worked out once, and a CentsMeter shows how sharp or flat a note is on a
+bar of LEDs with every picture of it worked out up front
+
+An Animator runs animations without blocking, one frame at a time at their own frame rate, in between
+whatever else the program is doing
 """
 
+import time
 import board
 import neopixel
 
@@ -19,6 +31,16 @@ BRIGHTNESS = 0.1
 ring = neopixel.NeoPixel(PIN, NUM_LEDS, brightness = BRIGHTNESS)
 #------------
 
+#The palette, the colors as they were added, and the same colors with the brightness and gamma baked in
+__palette_colors = []
+__palette = []
+__palette_brightness = 1.0
+__palette_gamma = 1.0
+#The baked colors of the palette, which don't need to be checked again when they are drawn
+__valid_colors = set()
+#The gradients that have been drawn, by their colors and length
+__gradients = {}
+
 def get_ring():
     return ring
 
@@ -40,11 +62,78 @@ def __check_color_valid(color):
     return True, ""
 
 
-def set_pixel(color, pixel, ring = ring):
-    #Make sure the color is valid
+def __as_color(color, which = ""):
+    """
+    Just a private method that looks up palette handles and checks any other color, so the colors of the
+    palette are never checked again
+
+    Returns the color to draw, or None if it isn't valid
+    """
+    if(type(color) is int):
+        if(color < 0 or color >= len(__palette)):
+            print("ERROR:", which + "No color in the palette has the handle", color)
+            return None
+        return __palette[color]
+    if(type(color) is tuple and color in __valid_colors):
+        return color
+
+    valid_color, error_msg = __check_color_valid(color)
+    if(not valid_color):
+        print("ERROR:", which + error_msg)
+        return None
+    return color
+
+
+def __bake(color):
+    """Just a private method that scales a color by the palette's brightness and gamma"""
+    return tuple(int(round(255 * (c / 255) ** __palette_gamma * __palette_brightness)) for c in color)
+
+
+def add_color(color):
+    """
+    Checks `color` and adds it to the palette
+
+    Returns the handle of the color, which can be passed to any of the functions instead of the color, or
+    None if the color isn't valid
+    """
     valid_color, error_msg = __check_color_valid(color)
     if(not valid_color):
         print("ERROR:", error_msg)
+        return None
+
+    __palette_colors.append(tuple(color))
+    __palette.append(__bake(color))
+    __valid_colors.add(__palette[-1])
+    return len(__palette) - 1
+
+
+def get_color(handle):
+    """Returns the color of the palette with the handle `handle`, with the brightness and gamma baked in"""
+    return __palette[handle]
+
+
+def bake_brightness(brightness = BRIGHTNESS, gamma = 1.0, ring = ring):
+    """
+    Bakes `brightness` and `gamma` into the colors of the palette, and sets the ring's own brightness to 1
+
+    The ring then sends the colors as they are instead of scaling every one of them when it is set. Colors
+    that aren't in the palette are drawn at full brightness from then on. The handles stay the same.
+    """
+    global __palette_brightness, __palette_gamma
+    __palette_brightness = brightness
+    __palette_gamma = gamma
+    ring.brightness = 1.0
+
+    __valid_colors.clear()
+    for i in range(len(__palette_colors)):
+        __palette[i] = __bake(__palette_colors[i])
+        __valid_colors.add(__palette[i])
+
+
+def set_pixel(color, pixel, ring = ring):
+    #Make sure the color is valid
+    color = __as_color(color)
+    if(color is None):
         return
 
     ring[pixel] = color
@@ -53,9 +142,8 @@ def set_ring_color(color, ring = ring):
     """Takes in `color`, and uses neopixels built in function to set all the LEDs to that color"""
 
     #Make sure tahe color is valid
-    valid_color, error_msg = __check_color_valid(color)
-    if(not valid_color):
-        print("ERROR:", error_msg)
+    color = __as_color(color)
+    if(color is None):
         return
 
 
@@ -77,9 +165,8 @@ def bar_graph(color, end_pos, fill_mode = True, start_pos = 0, ring = ring, clea
         print("ERROR: Your start position can't be less than 0")
         return
     #Make sure the color is valid
-    valid_color, error_msg = __check_color_valid(color)
-    if(not valid_color):
-        print("ERROR:", error_msg)
+    color = __as_color(color)
+    if(color is None):
         return
 
     #Clear the ring before putting anything else on it
@@ -97,14 +184,104 @@ def bar_graph(color, end_pos, fill_mode = True, start_pos = 0, ring = ring, clea
         ring[end_pos-1] = color
 
 
+class FrameBuffer():
+    """
+    A stand-in for the ring that holds the colors the LEDs should be, and only sends them once per frame
+
+    It can be passed as the `ring` of any of the functions in here, since it has the same len(), fill() and
+    indexing as the ring. Nothing is sent while drawing: it turns off the ring's auto_write, and show()
+    compares the colors against the ones it last sent, writes only the LEDs that changed into the ring and
+    calls the ring's show() once, or not at all if nothing changed. So a frame that draws the same thing as
+    the last one costs nothing on the data pin.
+    """
+
+    def __init__(self, ring = ring):
+        self.__ring = ring
+        ring.auto_write = False
+        self.__pixels = [(0,0,0)] * len(ring) #the colors the LEDs should be
+        self.__shown = [None] * len(ring) #the colors last sent to the LEDs, None until the first show()
+
+    def __len__(self):
+        return len(self.__pixels)
+
+    def __getitem__(self, pixel):
+        return self.__pixels[pixel]
+
+    def __setitem__(self, pixel, color):
+        self.__pixels[pixel] = color
+
+    def fill(self, color):
+        """Sets all the LEDs to `color`"""
+        pixels = self.__pixels
+        for i in range(len(pixels)):
+            pixels[i] = color
+
+    def show(self):
+        """
+        Sends the LEDs that changed since the last show() to the ring
+
+        Returns: bool, True if anything was sent
+        """
+        pixels = self.__pixels
+        shown = self.__shown
+        changed = False
+        for i in range(len(pixels)):
+            if pixels[i] != shown[i]:
+                self.__ring[i] = pixels[i]
+                shown[i] = pixels[i]
+                changed = True
+        if changed:
+            self.__ring.show()
+        return changed
+
+    def get_ring(self):
+        """
+        A getter method for the ring it draws on
+
+        Returns: neopixel.NeoPixel
+        """
+        return self.__ring
+
+
 #Shaded bar graph (start color, stop color, position, dot/fill, dot color) -
 #same as bar graph except the color transitions from a start to finish color)
 
-def shaded_bar_graph(start_color, end_color, end_pos, start_pos = 0, ring = ring):
+def __get_gradient(start_color, end_color, transition_length):
+    """
+    Just a private method that returns the colors of a gradient from start_color to end_color over
+    transition_length LEDs, which are only worked out the first time and then kept in __gradients
+    """
+    key = (tuple(start_color), tuple(end_color), transition_length)
+    if key in __gradients:
+        return __gradients[key]
+
+    #Finds the slope for each RGB compenent indivdually
+    slope = [
+        (end_color[0] - start_color[0]) / transition_length,
+        (end_color[1] - start_color[1]) / transition_length,
+        (end_color[2] - start_color[2]) / transition_length
+    ]
+
+    #Calculate the color at each point with the slope equation y = mx + b
+    gradient = tuple(
+        (
+            int(slope[0]*i + start_color[0]),
+            int(slope[1]*i + start_color[1]),
+            int(slope[2]*i + start_color[2])
+        )
+        for i in range(0, transition_length)
+    )
+    __gradients[key] = gradient
+    return gradient
+
+
+def shaded_bar_graph(start_color, end_color, end_pos, start_pos = 0, ring = ring, clear = True):
     """
     Shaded bar graph is the same idea as the regular bar graph except it takes in 2 colors and creates a
     gradient of the 2 colors from the start position to the end position
 
+    The colors of each gradient are only worked out the first time it is drawn, after that drawing it is just
+    setting the LEDs. If `clear` is False the rest of the ring is left as it is.
     """
 
     #Error handling, makes sure the end pos is lower than the number of leds and that the start positon is greater than 0
@@ -115,47 +292,82 @@ def shaded_bar_graph(start_color, end_color, end_pos, start_pos = 0, ring = ring
         print("ERROR: Your start position can't be less than 0")
         return
     #Make sure the color is valid
-    valid_color, error_msg = __check_color_valid(start_color)
-    if(not valid_color):
-        print("ERROR: Start", error_msg)
-        return
-    valid_color, error_msg = __check_color_valid(end_color)
-    if(not valid_color):
-        print("ERROR: End", error_msg)
+    start_color = __as_color(start_color, "Start ")
+    end_color = __as_color(end_color, "End ")
+    if(start_color is None or end_color is None):
         return
 
 
     #Clear the ring before putting anything else on it
-    ring.fill((0,0,0))
+    if(clear):
+        ring.fill((0,0,0))
 
-    #Gets the number of leds between end and start
-    transition_length = (end_pos-start_pos)
+    gradient = __get_gradient(start_color, end_color, end_pos - start_pos)
+    for i in range(0, len(gradient)):
+        ring[start_pos + i] = gradient[i]
 
-    #Finds the slope for each RGB compenent indivdually
-    slope = [
-        (end_color[0] - start_color[0]) / transition_length,
-        (end_color[1] - start_color[1]) / transition_length,
-        (end_color[2] - start_color[2]) / transition_length
-    ]
 
-    #Finds the starting value for each RGB compenent indivdually
-    y_offset = [
-        start_color[0],
-        start_color[1],
-        start_color[2]
-    ]
+class CentsMeter():
+    """
+    Shows how many cents sharp or flat a note is on a bar of LEDs, so the tuner works without the motor
 
-    for i in range(0,transition_length):
+    Made by get_cents_meter, which works out every picture the meter can show up front, so drawing it is just
+    setting the LEDs. The pictures are spread evenly over the range, and the middle one is in tune
+    """
 
-        #Calculate the color at the point with the slope equation y = mx + b
-        #for each led from start to end
-        calculated_color = (
-            slope[0]*i + y_offset[0],
-            slope[1]*i + y_offset[1],
-            slope[2]*i + y_offset[2]
-        )
+    def __init__(self, frames, start_pos, cents_range):
+        self.__frames = frames #the colors of the LEDs for each position of the meter
+        self.__start_pos = start_pos
+        self.__cents_range = cents_range
+
+    def get_position(self, cents):
+        """
+        A getter method for which picture of the meter shows an offset of `cents`, counting from the most flat
+
+        Returns: int
+        """
+        length = len(self.__frames)
+        position = int((cents + self.__cents_range) * length / (2 * self.__cents_range))
+        return min(max(position, 0), length - 1)
 
-        ring[start_pos + i] = calculated_color
+    def draw(self, cents, ring = ring):
+        """Draws the meter with the offset `cents` (negative when flat) on `ring`"""
+        frame = self.__frames[self.get_position(cents)]
+        start_pos = self.__start_pos
+        for i in range(len(frame)):
+            ring[start_pos + i] = frame[i]
+
+
+def get_cents_meter(start_pos = 3, end_pos = 11, cents_range = 50.0, center_color = (0,255,0),
+                    edge_color = (255,0,0), background = 0.2):
+    """
+    Makes a CentsMeter on the LEDs from start_pos(inclusive) to end_pos(exclusive)
+
+    The meter goes from `cents_range` cents flat at start_pos to `cents_range` cents sharp at end_pos-1, over
+    a gradient from `edge_color` at the ends to `center_color` in the middle. The gradient is always lit dimly
+    (`background` times as bright), and the LED of the current offset at full brightness. With an even number
+    of LEDs there is no middle one, so in tune lights the middle two, and sharp and flat get as many LEDs each.
+
+    Returns the meter, or None if a color isn't valid
+    """
+    center_color = __as_color(center_color, "Center ")
+    edge_color = __as_color(edge_color, "Edge ")
+    if(center_color is None or edge_color is None):
+        return None
+
+    #The gradient goes from the start up to the middle LED (or the middle two), and back down to the end
+    length = end_pos - start_pos
+    half = (length + 1) // 2
+    rising = __get_gradient(edge_color, center_color, half - 1) + (center_color,) if half > 1 else (center_color,)
+    colors = rising + tuple(reversed(rising))[2 * half - length:]
+    dim = tuple((int(r * background), int(g * background), int(b * background)) for (r, g, b) in colors)
+
+    frames = tuple(dim[0:i] + (colors[i],) + dim[i + 1:] for i in range(length))
+    if length % 2 == 0:
+        middle = length // 2
+        in_tune = dim[0:middle - 1] + colors[middle - 1:middle + 1] + dim[middle + 1:]
+        frames = frames[0:middle] + (in_tune,) + frames[middle:]
+    return CentsMeter(frames, start_pos, cents_range)
 
 
 #Dot on background (color, position, dot color) -
@@ -172,22 +384,19 @@ def dot_on_background(fill_color, dot_pos, dot_color, ring = ring):
         print("ERROR: Your dot_pos is larger than the number of LEDS")
         return
     #Make sure the color is valid
-    valid_color, error_msg = __check_color_valid(fill_color)
-    if(not valid_color):
-        print("ERROR: Fill", error_msg)
-        return
-    valid_color, error_msg = __check_color_valid(dot_color)
-    if(not valid_color):
-        print("ERROR: Dot", error_msg)
+    fill_color = __as_color(fill_color, "Fill ")
+    dot_color = __as_color(dot_color, "Dot ")
+    if(fill_color is None or dot_color is None):
         return
 
     ring.fill(fill_color)
     ring[dot_pos] = dot_color
 
 
-def animate_snake(color = (255,0,0), snake_length = 4, start_pos = 0, frames = 24, ring = ring):
+def snake_frames(color = (255,0,0), snake_length = 4, start_pos = 0, frames = 24, ring = ring):
     """
-    Just a fun little method for animating a snake for an amount of frames
+    The frames of the snake of animate_snake, as a generator that draws the next frame each time it is
+    advanced, so an Animator can run it without blocking
     """
     #Clear the LEDS
     ring.fill((0,0,0))
@@ -197,7 +406,8 @@ def animate_snake(color = (255,0,0), snake_length = 4, start_pos = 0, frames = 2
 
     #Initially fill in the snake
     for i in range(start_pos, start_pos + snake_length):
-        ring[i] = color
+        ring[i % len(ring)] = color
+    yield
 
     #for each frame, turn off the tail of the snake, turn on the led in front of the snake and set the previous head the the body color
     for frame in range(0,frames):
@@ -210,6 +420,32 @@ def animate_snake(color = (255,0,0), snake_length = 4, start_pos = 0, frames = 2
 
         #set the previous head the the body color
         ring[(start_pos + snake_length + frame - 1) % len(ring)] = color
+        yield
+
+
+def rainbow_frames(end_pos = NUM_LEDS, start_pos = 0, step = 8, cycles = 1, brightness = 1.0, ring = ring):
+    """
+    A rainbow that cycles through the LEDs from start_pos(inclusive) to end_pos(exclusive), as a generator
+    that draws the next frame each time it is advanced
+
+    Each frame moves the colors `step` places along the wheel, so one cycle is 256/step frames. The colors
+    are scaled by `brightness`, for rings with their brightness baked into the palette.
+    """
+    length = end_pos - start_pos
+    for j in range(0, 256 * cycles, step):
+        for i in range(0, length):
+            r, g, b = wheel(((i * 256 // length) + j) & 255)
+            ring[start_pos + i] = (int(r * brightness), int(g * brightness), int(b * brightness))
+        yield
+
+
+def animate_snake(color = (255,0,0), snake_length = 4, start_pos = 0, frames = 24, ring = ring):
+    """
+    Just a fun little method for animating a snake for an amount of frames
+
+    This blocks until the snake is done, an Animator can run snake_frames instead without blocking
+    """
+    for frame in snake_frames(color, snake_length, start_pos, frames, ring):
 
         #A very imprescise way to get the delay between frames that I want
         #without this it's too fast, and time.sleep() doesn't have enough fidelity
@@ -219,6 +455,65 @@ def animate_snake(color = (255,0,0), snake_length = 4, start_pos = 0, frames = 2
             x -= 1
 
 
+class Animator():
+    """
+    Runs animations in between everything else instead of blocking until they are done
+
+    An animation is a generator that draws its next frame on the ring each time it is advanced, like
+    snake_frames or rainbow_frames. Each one started has its own frame rate, and every call to tick() draws
+    the next frame of the ones that are due. It never catches up on frames it was too late for, so an
+    animation just runs slower if tick() isn't called as often as its frame rate. The LEDs are only sent
+    when the ring is shown (or on their own if the ring has auto_write on).
+    """
+
+    def __init__(self):
+        self.__animations = [] #a [generator, nanoseconds per frame, time of the next frame] for each animation
+
+    def start(self, frames, fps = 30, now = None):
+        """Starts running the animation `frames` at `fps` frames per second, with its first frame due now"""
+        if now is None:
+            now = time.monotonic_ns()
+        self.__animations.append([frames, int(1000000000 / fps), now])
+
+    def tick(self, now = None):
+        """
+        Draws the next frame of every animation that is due, and forgets the ones that have finished
+
+        Returns: bool, True if any frame was drawn
+        """
+        if now is None:
+            now = time.monotonic_ns()
+        drawn = False
+        for animation in list(self.__animations):
+            if now < animation[2]:
+                continue
+            try:
+                next(animation[0])
+            except StopIteration:
+                self.__animations.remove(animation)
+                continue
+            drawn = True
+            animation[2] += animation[1]
+            if animation[2] <= now:
+                #it was more than a frame late, so the next frame is a whole frame from now
+                animation[2] = now + animation[1]
+        return drawn
+
+    def stop(self, frames = None):
+        """Stops the animation `frames`, or every animation if it is None"""
+        if frames is None:
+            self.__animations = []
+        else:
+            self.__animations = [animation for animation in self.__animations if animation[0] is not frames]
+
+    def is_running(self):
+        """
+        A getter method for whether any animation is still running
+
+        Returns: bool
+        """
+        return len(self.__animations) > 0
+
 
 def maprange( a, b, s):
     # Did not write this got it from rosseta code
@@ -0,0 +1,271 @@
+"""
+Capture and analysis pipelines for the guitar tuner
+
+A pipeline captures frames through a framer from captureFunctions (FrameBuffers for separate frames, or
+FrameRing for overlapping frames that share a ring buffer) and hands each one to a `process` function,
+`process(frame, time_step)`. The process function can be a generator that yields between its stages
+(say after the pitch detection, and again before a network push). Each yield is a point where the
+pipeline can go back to capturing, so the next frame's capture doesn't have to wait for the whole
+previous frame to be finished with. It stops when something calls `stop()`.
+
+If the capture keeps throwing frames away, the pipeline doesn't wait for a good one forever. After
+`max_wait` seconds without a frame it calls the `idle` function given to `run` instead (if there is one),
+so things like a kill switch still get checked.
+
+    - SerialPipeline captures, then processes, then captures again, the way Tuner.py always did
+    - CooperativePipeline runs capture and processing as asyncio tasks, switching at the yields, so on
+      the board the next capture starts as soon as the processing of the last frame yields. A capture
+      holds the event loop until its frame is full though, so on one core the two still never overlap
+    - ThreadedPipeline captures on a worker thread on a computer, so capture never waits for processing
+
+All of them keep track of the duty cycle, the fraction of the time spent capturing audio.
+`get_pipeline` picks the best one available.
+"""
+
+import time
+
+from captureFunctions import FrameBuffers
+
+try:
+    import threading
+except ImportError:
+    threading = None
+
+try:
+    import asyncio
+except ImportError:
+    asyncio = None
+
+
+def drive(steps):
+    """
+    Runs a process function's result to the end if it is a generator, does nothing if it isn't
+
+    Returns: the number of stages it yielded at
+    """
+    stages = 0
+    if hasattr(steps, "send"):
+        for stage in steps:
+            stages += 1
+    return stages
+
+
+class SerialPipeline():
+    '''
+    Captures a frame, processes it, and only then captures the next one
+    '''
+
+    def __init__(self, capture, frames, max_wait = 0.5):
+        """
+        `capture` is a capture source from captureFunctions, `frames` the framer it is read through, and
+        `max_wait` the longest it keeps trying to capture a frame, in seconds
+        """
+        self._capture = capture
+        self._framer = frames
+        self._max_wait_ns = int(max_wait * 1000000000)
+        self._running = False
+        self._capture_ns = 0 #total time spent capturing
+        self._total_ns = 0 #total time the pipeline has been running
+        self._frames = 0
+
+    def _read(self):
+        """
+        Just a private method that captures the next frame, and retries until the framer has a whole one
+        (when the capture throws samples away, or the ring isn't full yet), for up to `max_wait` seconds
+
+        Returns: (frame, float), the frame and its time step, or None for the frame if there still wasn't one
+        """
+        start_time = time.monotonic_ns()
+        frame = self._framer.read(self._capture)
+        while frame is None and time.monotonic_ns() - start_time < self._max_wait_ns:
+            frame = self._framer.read(self._capture)
+        self._capture_ns += time.monotonic_ns() - start_time
+        return frame, self._capture.get_sample_period()
+
+    def run(self, process, idle = None):
+        """
+        Captures and processes frames until `stop()` is called, calling `idle()` whenever no frame could be
+        captured for `max_wait` seconds
+        """
+        self._running = True
+        start_time = time.monotonic_ns()
+        try:
+            while self._running:
+                frame, time_step = self._read()
+                if frame is None:
+                    if idle is not None:
+                        idle()
+                    continue
+                drive(process(frame, time_step))
+                self._frames += 1
+        finally:
+            self._running = False
+            self._total_ns += time.monotonic_ns() - start_time
+
+    def stop(self):
+        """Stops the pipeline after the frame it is on"""
+        self._running = False
+
+    def get_duty_cycle(self):
+        """
+        A getter method for the fraction of the time spent capturing audio, 1.0 would mean no audio is missed
+
+        Returns: float, between 0 and 1
+        """
+        if self._total_ns == 0:
+            return 0.0
+        return self._capture_ns / self._total_ns
+
+    def get_frames(self):
+        """
+        A getter method for the number of frames processed so far
+
+        Returns: int
+        """
+        return self._frames
+
+
+class CooperativePipeline(SerialPipeline):
+    '''
+    Runs capture and processing as two asyncio tasks that share the framer
+
+    The capture task captures a frame whenever the framer has room for one and queues it, the processing
+    task takes the oldest queued frame and processes it, and they switch every time the process function
+    yields. A frame (or a hop) is always captured in one go so there is never a gap in the middle of it.
+
+    That also means the capture blocks the event loop for the whole frame, and the processing only runs
+    between captures, so this doesn't overlap them any more than SerialPipeline does (its duty cycle is
+    about the same). It just lets a long process function be split up at its yields. Overlapping them
+    for real takes a capture that runs in the background, like ThreadedPipeline's worker thread.
+    '''
+
+    def __init__(self, capture, frames, max_wait = 0.5):
+        super().__init__(capture, frames, max_wait)
+        self.__free = frames.get_depth() #how many more frames can be captured before one is processed
+        self.__full = []
+
+    async def __capture_task(self):
+        while self._running:
+            if self.__free == 0:
+                await asyncio.sleep(0)
+                continue
+            self.__free -= 1
+            self.__full.append(self._read())
+            await asyncio.sleep(0)
+
+    async def __process_task(self, process, idle):
+        while self._running:
+            if not self.__full:
+                await asyncio.sleep(0)
+                continue
+            frame, time_step = self.__full.pop(0)
+            if frame is None:
+                self.__free += 1
+                if idle is not None:
+                    idle()
+                continue
+            steps = process(frame, time_step)
+            if hasattr(steps, "send"):
+                for stage in steps:
+                    await asyncio.sleep(0)
+            self.__free += 1
+            self._frames += 1
+
+    async def __main(self, process, idle):
+        await asyncio.gather(self.__capture_task(), self.__process_task(process, idle))
+
+    def run(self, process, idle = None):
+        """
+        Captures and processes frames until `stop()` is called, calling `idle()` whenever no frame could be
+        captured for `max_wait` seconds
+        """
+        self._running = True
+        start_time = time.monotonic_ns()
+        try:
+            asyncio.run(self.__main(process, idle))
+        finally:
+            self._running = False
+            self._total_ns += time.monotonic_ns() - start_time
+
+
+class ThreadedPipeline(SerialPipeline):
+    '''
+    Captures on a worker thread while the calling thread processes, for running on a computer
+    '''
+
+    def __init__(self, capture, frames, max_wait = 0.5):
+        super().__init__(capture, frames, max_wait)
+        self.__free = frames.get_depth()
+        self.__full = []
+        self.__condition = threading.Condition()
+
+    def __capture_worker(self):
+        condition = self.__condition
+        try:
+            while True:
+                with condition:
+                    while self._running and self.__free == 0:
+                        condition.wait()
+                    if not self._running:
+                        return
+                    self.__free -= 1
+                frame = self._read()
+                with condition:
+                    self.__full.append(frame)
+                    condition.notify_all()
+        finally:
+            # if the capture failed, the processing side isn't left waiting for a frame that never comes
+            with condition:
+                self._running = False
+                condition.notify_all()
+
+    def run(self, process, idle = None):
+        """
+        Captures and processes frames until `stop()` is called, calling `idle()` whenever no frame could be
+        captured for `max_wait` seconds
+        """
+        condition = self.__condition
+        self._running = True
+        start_time = time.monotonic_ns()
+        worker = threading.Thread(target=self.__capture_worker, daemon=True)
+        worker.start()
+
+        try:
+            while self._running:
+                with condition:
+                    while self._running and not self.__full:
+                        condition.wait()
+                    if not self.__full:
+                        break
+                    frame, time_step = self.__full.pop(0)
+                if frame is None:
+                    if idle is not None:
+                        idle()
+                else:
+                    drive(process(frame, time_step))
+                    self._frames += 1
+                with condition:
+                    self.__free += 1
+                    condition.notify_all()
+        finally:
+            with condition:
+                self._running = False
+                condition.notify_all()
+            worker.join()
+            self._total_ns += time.monotonic_ns() - start_time
+
+
+def get_pipeline(capture, frames):
+    """
+    Returns the best pipeline available, a thread if there is threading (on a computer), asyncio tasks if
+    there is asyncio (on the board with the asyncio library), or the plain serial loop otherwise
+
+    `frames` is the framer to capture through, or just a frame length for two FrameBuffers of that length
+    """
+    if isinstance(frames, int):
+        frames = FrameBuffers(frames, 2)
+    if threading is not None:
+        return ThreadedPipeline(capture, frames)
+    if asyncio is not None:
+        return CooperativePipeline(capture, frames)
+    return SerialPipeline(capture, frames)
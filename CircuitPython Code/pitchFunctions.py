@@ -0,0 +1,266 @@
+"""
+Pitch detectors for the guitar tuner
+
+Every detector here has the same inputs and output as get_freq_correlation in Tuner.py, so they can be
+swapped in for it:
+    - `wave` is the centered waveform, a list or array of samples
+    - `time_delta` is the time between two samples in seconds
+    - the frequency is returned in Hz, or 0.0 if no pitch was found
+
+Unlike the peak walk in get_freq_correlation, which only finds the period to the nearest whole sample,
+these interpolate between samples. At the ~12.5 kHz the tuner samples at, one sample on the high E
+string is about 4.5 cents, which is why the detected frequency used to bounce between two values.
+
+    - get_freq_yin is the YIN algorithm
+    - get_freq_goertzel picks the closest string with a bank of Goertzel filters, then only searches the
+      lags around that string's period
+    - get_freq_hps finds the fundamental in the spectrum with the harmonic product spectrum
+"""
+
+import math
+
+from arrayFunctions import np, FLOAT, as_float, next_pow2, cumsum, running_sum, cross_correlate_fft, power_spectrum
+from correlationFunctions import ENGINE_DOT, parabolic_offset, decimate, get_lag_band
+
+# The six open strings in standard tuning (E2 A2 D3 G3 B3 E4), in Hz
+STANDARD_TUNING = (82.407, 110.000, 146.832, 195.998, 246.942, 329.628)
+
+# Hann windows for `get_freq_hps`, keyed by length
+__hann_windows = {}
+
+# Filter banks for `get_freq_goertzel`, keyed by (strings, sample period, length, spread)
+__goertzel_banks = {}
+
+
+def yin_difference(uwave, max_lag):
+    """
+    Returns the cumulative mean normalized difference function of YIN for lags 0 to max_lag
+
+    The difference at a lag is the sum of (x[j] - x[j + lag])^2 over the first half of the wave, which
+    is expanded into energy terms and a correlation so it can be computed with the FFT instead of a loop.
+    It is then divided by its own running mean, so it starts at 1 and dips towards 0 at the period
+    """
+    window = len(uwave) - max_lag
+    lags = max_lag + 1
+
+    correlation = cross_correlate_fft(uwave, uwave[0:window], next_pow2(len(uwave) + window))[0:lags]
+    energy = running_sum(uwave * uwave, window, lags)
+    difference = energy[0] + energy - 2 * correlation
+    difference[0] = 0.0
+
+    # normalizes by the mean of the difference up to each lag
+    total = cumsum(difference)
+    total[0] = 1.0
+    normalized = difference * np.arange(lags) / total
+    normalized[0] = 1.0
+    return normalized
+
+
+def get_freq_yin(wave, time_delta, threshold = 0.15, min_freq = 60.0, max_freq = 1000.0):
+    """
+    Finds the frequency of `wave` with the YIN algorithm
+
+    The period is the first lag where the normalized difference dips below `threshold` (or would between
+    that lag and the next), or half of it if the difference nearly dips there too, moved down to the
+    bottom of that dip and then refined with parabolic interpolation. If it never dips below the threshold
+    the lowest point is used, unless that is so high the wave is not periodic at all.
+
+    Only lags for frequencies between `min_freq` and `max_freq` are searched. A frame without any signal
+    in it (all the same value) has no pitch, and neither does one where the result isn't a finite number
+    """
+    uwave = as_float(wave)
+    if np.max(uwave) == np.min(uwave):
+        return 0.0
+    min_lag = max(2, int(1 / (max_freq * time_delta)))
+    max_lag = min(len(uwave) // 2, int(1 / (min_freq * time_delta)) + 2)
+    if min_lag >= max_lag - 1:
+        return 0.0
+
+    normalized = yin_difference(uwave, max_lag)
+    search = normalized[min_lag:max_lag]
+
+    # the lowest the parabola through each lag and its neighbours gets within half a lag of it, since the
+    # periods of the high notes are only a few lags long and their dips mostly fall between two lags
+    left = normalized[min_lag - 1:max_lag - 1]
+    right = normalized[min_lag + 1:max_lag + 1]
+    slope = (right - left) / 2
+    curvature = np.maximum(left + right - 2 * search, 1e-9)
+    offset = np.clip(-slope / curvature, -0.5, 0.5)
+    bottom = search + slope * offset + curvature * offset * offset / 2
+
+    # the first lag below the threshold, or the lowest point if there isn't one
+    below = bottom < threshold
+    lag = int(np.argmax(below))
+    if not below[lag]:
+        lag = int(np.argmin(bottom))
+        if bottom[lag] > 0.5:
+            return 0.0
+
+    # a dip nearly as deep at half that lag is the real period, which fell too far between two lags to get
+    # below the threshold (the difference at half the period is about 0.75 for a real guitar string)
+    half = (lag + min_lag) // 2 - min_lag
+    if half >= 1:
+        nearby = bottom[half - 1:half + 2]
+        closest = int(np.argmin(nearby))
+        if nearby[closest] < 2 * threshold:
+            lag = half - 1 + closest
+    lag += min_lag
+
+    # walks down to the bottom of the dip
+    while lag + 1 < max_lag and normalized[lag + 1] < normalized[lag]:
+        lag += 1
+
+    period = (lag + parabolic_offset(normalized[lag - 1], normalized[lag], normalized[lag + 1])) * time_delta
+    if not math.isfinite(period) or period <= 0:
+        return 0.0
+    return float(1 / period)
+
+
+def goertzel_bank(uwave, tables):
+    """
+    Finds the power of `uwave` at every frequency of a bank of Goertzel filters, from the cosine and sine
+    tables the bank was made with (see __get_goertzel_bank)
+
+    The power at a frequency is the squared length of the dot products of the wave with a cosine and a sine
+    at it, which is what a Goertzel filter works out one sample at a time. The wave is cut into rows, so the
+    dot products are a matrix product with tables for the samples within a row, added up against tables for
+    the starts of the rows. That is a few array operations for the whole bank, and much smaller tables than
+    a whole cosine and sine for every filter
+    """
+    inner_cos, inner_sin, outer_cos, outer_sin = tables
+    rows = uwave.reshape((len(outer_cos), len(inner_cos)))
+    real = np.dot(rows, inner_cos)
+    imaginary = np.dot(rows, inner_sin)
+    total_real = np.sum(outer_cos * real - outer_sin * imaginary, axis=0)
+    total_imaginary = np.sum(outer_sin * real + outer_cos * imaginary, axis=0)
+    return total_real * total_real + total_imaginary * total_imaginary
+
+
+def __get_goertzel_bank(strings, time_delta, length, spread):
+    """
+    Just a private method that makes (and caches) the Hann window and the cosine and sine tables of a bank
+
+    There is a filter every half of a half-step, from `spread` half-steps below each string to `spread` above
+    """
+    key = (strings, round(time_delta * 10000000), length, spread)
+    if key not in __goertzel_banks:
+        steps = int(2 * spread)
+        omegas = [2 * math.pi * target * 2 ** (step / 24) * time_delta
+                  for target in strings for step in range(-steps, steps + 1)]
+        # the rows are as close to square as the length allows
+        width = 1
+        for size in range(1, int(math.sqrt(length)) + 1):
+            if length % size == 0:
+                width = size
+        starts = range(0, length, width)
+        tables = (np.array([[math.cos(omega * k) for omega in omegas] for k in range(width)], dtype=FLOAT),
+                  np.array([[math.sin(omega * k) for omega in omegas] for k in range(width)], dtype=FLOAT),
+                  np.array([[math.cos(omega * k) for omega in omegas] for k in starts], dtype=FLOAT),
+                  np.array([[math.sin(omega * k) for omega in omegas] for k in starts], dtype=FLOAT))
+        window = [0.5 - 0.5 * math.cos(2 * math.pi * n / (length - 1)) for n in range(length)]
+        __goertzel_banks[key] = (tables, np.array(window, dtype=FLOAT), 2 * steps + 1)
+    return __goertzel_banks[key]
+
+
+def get_freq_goertzel(wave, time_delta, strings = STANDARD_TUNING, factor = 8, spread = 2.5, floor = 0.1,
+                      engine = ENGINE_DOT, template_size = 512):
+    """
+    Finds the frequency of `wave` by first picking which of `strings` is being played, then finding the
+    period only near that string
+
+    The string is picked with a bank of Goertzel filters run on a copy of the wave decimated by `factor`, or
+    by less if the highest string would be too close to (or over) the decimated Nyquist frequency. On the
+    low strings the harmonics can be louder than the fundamental, and they fall near the higher strings, so
+    it isn't just the loudest filter that wins: it is the lowest string with a filter that has at least
+    `floor` times the power of the loudest one (and a peak in its lags, otherwise the next one up).
+
+    The period is then found with the band-limited correlation over just the lags within `spread` half-steps
+    of that string, instead of the whole range of the guitar
+    """
+    uwave = as_float(wave)
+    # keeps the top of the highest string's filters below 0.8 of the decimated Nyquist frequency
+    factor = max(1, min(factor, int(0.8 / (2 * max(strings) * 2 ** (spread / 12) * time_delta))))
+    coarse = decimate(uwave, factor)
+    tables, window, per_string = __get_goertzel_bank(tuple(strings), time_delta * factor, len(coarse), spread)
+    powers = goertzel_bank(coarse * window, tables)
+
+    loudest = np.max(powers)
+    if loudest <= 0:
+        return 0.0
+    for i in range(len(strings)):
+        if np.max(powers[i * per_string:(i + 1) * per_string]) < floor * loudest:
+            continue
+        target = strings[i]
+        # at least two lags either side of the period, the spread of a high note can be less than one lag
+        period = 1 / (target * time_delta)
+        low = min(target * 2 ** (-spread / 12), 1 / ((period + 2) * time_delta))
+        high = max(target * 2 ** (spread / 12), 1 / (max(1.0, period - 2) * time_delta))
+        lag = get_lag_band(uwave, time_delta, engine, template_size, 0.91, low, high)
+        # a note between two strings can leak into the edge of the lower one's filters, and then there is no
+        #   peak inside its lags, so the next string up gets a go
+        if lag != 0:
+            return float(1 / (lag * time_delta))
+    return 0.0
+
+
+def __get_hann_window(length):
+    """Just a private method that makes (and caches) a Hann window of `length` samples"""
+    if length not in __hann_windows:
+        __hann_windows[length] = np.array([0.5 - 0.5 * math.cos(2 * math.pi * n / (length - 1))
+                                           for n in range(length)], dtype=FLOAT)
+    return __hann_windows[length]
+
+
+def get_freq_hps(wave, time_delta, harmonics = 4, padding = 2, min_freq = 60.0, max_freq = 1000.0,
+                 min_prominence = 2.2):
+    """
+    Finds the frequency of `wave` with the harmonic product spectrum
+
+    The wave has its mean taken out, and is Hann windowed and zero padded to `padding` times the next power of 2 for a finer spectrum.
+    The spectrum is then multiplied by copies of itself squeezed by 2, 3, ... `harmonics`, so every harmonic
+    of a note lands on its fundamental and only the fundamental has all of them. This is why it still
+    works on the low strings, where just taking the loudest bin finds a harmonic instead. The product is a
+    sum of the log powers, so it doesn't underflow on the board's 32 bit floats.
+
+    The bin is refined with quadratic interpolation of the log power at the loudest of the note's harmonics,
+    since a harmonic h times higher pins the fundamental down h times finer
+
+    Only fundamentals between `min_freq` and `max_freq` are searched. If the peak of the product doesn't
+    stand out from the mean of the product by at least `min_prominence` per harmonic (in natural log units,
+    2.2 is about 9 times the power), there is no clear pitch, like in silence or noise, and it returns 0.0
+    """
+    uwave = as_float(wave)
+    n_fft = padding * next_pow2(len(uwave))
+    # without its mean, so the DC offset doesn't leak into the lowest bins
+    power = power_spectrum((uwave - np.mean(uwave)) * __get_hann_window(len(uwave)), n_fft)
+    if np.max(power) <= 0:
+        return 0.0
+    log_power = np.log(power + 1e-12 * np.max(power) + 1e-30)
+
+    resolution = 1 / (n_fft * time_delta) #Hz per bin
+    low = max(1, int(min_freq / resolution))
+    high = min(int(max_freq / resolution) + 1, (len(power) - 2) // harmonics)
+    if low >= high:
+        return 0.0
+
+    product = log_power[0:high]
+    for h in range(2, harmonics + 1):
+        product = product + log_power[0:h * high:h]
+    search = product[low:high]
+    fundamental = low + int(np.argmax(search))
+    if (np.max(search) - np.mean(search)) / harmonics < min_prominence:
+        return 0.0
+
+    # the loudest harmonic, moved to the top of its peak
+    loudest = 1
+    for h in range(2, harmonics + 1):
+        if power[h * fundamental] > power[loudest * fundamental]:
+            loudest = h
+    peak = loudest * fundamental
+    while peak + 2 < len(power) and power[peak + 1] > power[peak]:
+        peak += 1
+    while peak > 1 and power[peak - 1] > power[peak]:
+        peak -= 1
+
+    offset = parabolic_offset(log_power[peak - 1], log_power[peak], log_power[peak + 1])
+    return float((peak + offset) * resolution / loudest)
@@ -0,0 +1,410 @@
+"""
+Tracking of the signal between frames for the guitar tuner
+
+The pitch detection looks at one frame at a time. The classes in here look at how the frames change from one
+to the next, so the tuner can tell when a string is being played at all, and when it was plucked again:
+    - SilenceGate measures how loud each new block of samples is, and only lets the pitch detection run
+      while a string is ringing loud enough to be detected
+    - PitchTracker smooths the detected frequency from frame to frame and corrects octave errors, so the
+      meter doesn't jump around every time the detection picks the wrong peak
+    - StringLock notices when the same string keeps being tuned, and narrows the pitch detection down to it
+"""
+
+import math
+
+from arrayFunctions import np
+from correlationFunctions import ENGINE_DOT, lag_bounds, get_lag_band
+from pitchFunctions import STANDARD_TUNING
+
+
+class SilenceGate():
+    '''
+    An RMS gate with hysteresis and onset detection
+
+    The gate opens when the RMS of a block rises above `open_level` and only closes again when it falls below
+    the lower `close_level`, so a string that is just around one level doesn't flicker the gate. A block is an
+    onset (a new pluck) when the gate opens, or when it is already open and the block is more than `onset_ratio`
+    times louder than the recent average.
+
+    The levels are in the units of the samples, raw ADC counts in Tuner.py. Since the RMS is taken around the
+    block's own mean, the DC offset of the input doesn't matter.
+    '''
+
+    def __init__(self, open_level = 400, close_level = 200, onset_ratio = 2.0, smoothing = 0.2):
+        if close_level > open_level:
+            raise ValueError("The gate has to close at a lower level than it opens at")
+        self.__open_level = open_level
+        self.__close_level = close_level
+        self.__onset_ratio = onset_ratio
+        self.__smoothing = smoothing #how fast the average follows the level, from 0 to 1
+
+        self.__open = False
+        self.__onset = False
+        self.__level = 0.0
+        self.__average = 0.0
+
+    def update(self, block):
+        """
+        Measures the RMS of `block` (the new samples) and opens or closes the gate
+
+        Returns: bool, True if the gate is open
+        """
+        level = float(np.std(block))
+        if self.__open:
+            self.__onset = level > self.__onset_ratio * self.__average
+            if level < self.__close_level:
+                self.__open = False
+                self.__onset = False
+        else:
+            self.__open = level > self.__open_level
+            self.__onset = self.__open
+
+        # the average starts over from a new pluck, so the rest of the attack doesn't count as more onsets
+        if self.__onset:
+            self.__average = level
+        else:
+            self.__average += (level - self.__average) * self.__smoothing
+        self.__level = level
+        return self.__open
+
+    def is_open(self):
+        """
+        A getter method for whether the gate is open, so the last block was loud enough to analyze
+
+        Returns: bool
+        """
+        return self.__open
+
+    def is_onset(self):
+        """
+        A getter method for whether the last block was the start of a new pluck
+
+        Returns: bool
+        """
+        return self.__onset
+
+    def get_level(self):
+        """
+        A getter method for the RMS of the last block
+
+        Returns: float, in the units of the samples
+        """
+        return self.__level
+
+
+# The jumps (in cents) a pitch detector makes when it locks onto a harmonic or a sub-harmonic instead of the
+#   fundamental: an octave, an octave and a fifth (the 3rd harmonic), and two octaves
+HARMONIC_JUMPS = (1200.0, 1901.955, 2400.0)
+
+
+class PitchTracker():
+    '''
+    Smooths a stream of detected frequencies and keeps track of how much they can be trusted
+
+    Everything is done in cents from `reference` (A4), so the same amount of wobble counts the same on every
+    string. Each reading goes through three steps:
+        - a reading that jumps from the current pitch by about an octave (or another of the HARMONIC_JUMPS)
+          is snapped back by that jump, and any other jump of more than `max_jump` cents is ignored, unless
+          the new pitch holds for `hold` readings in a row, in which case the tracker moves over to it
+        - a reading more than `agreement` cents from where the pitch was heading is swapped for the median
+          of the last `history` readings, which takes out single bad readings
+        - a Kalman filter smooths what is left. It tracks how fast the pitch is moving as well as the pitch,
+          so it keeps up while a peg is turned instead of lagging behind it. The rate it moves at can change
+          by about `drift` cents per reading every reading, and the readings are off by about `noise` cents
+
+    A harmonic jump that holds for `hold` readings in a row moves the tracker over to it as well, so one
+    reading in the wrong octave right after a pluck doesn't pin the tracker to that octave.
+
+    The confidence is the fraction of the recent readings that agree with the median of the recent readings
+    to within `agreement` cents, so it drops with readings that had to be snapped, were ignored or found no
+    pitch at all, but not while the pitch is moving steadily as a peg is turned. Once the string has gone
+    quiet the readings that found no pitch can be forgotten with `forget_silence`, so they don't hold the
+    confidence down when it is played again.
+    '''
+
+    def __init__(self, reference = 440.0, history = 5, max_jump = 150.0, hold = 3, drift = 1.0, noise = 8.0,
+                 agreement = 25.0, snap_tolerance = 40.0):
+        self.__reference = reference
+        self.__history = history
+        self.__max_jump = max_jump
+        self.__hold = hold
+        self.__variance_drift = drift * drift
+        self.__variance_noise = noise * noise
+        self.__agreement = agreement
+        self.__snap_tolerance = snap_tolerance
+        self.reset()
+
+    def reset(self):
+        """Forgets the tracked pitch, for when a new note is plucked"""
+        self.__readings = [] #the last few readings in cents, after snapping
+        self.__agreeing = [] #whether each of the last few readings agreed with the pitch, None if it was silent
+        self.__pending = [] #readings of a new pitch that haven't held for long enough yet
+        self.__cents = None
+        self.__rate = 0.0 #how many cents the pitch moves per reading
+        self.__variance = 0.0 #the covariance of the pitch and the rate, as its three different entries
+        self.__covariance = 0.0
+        self.__rate_variance = 0.0
+
+    def __cents_of(self, freq):
+        """A private method that converts a frequency to cents from the reference"""
+        return 1200 * math.log(freq / self.__reference, 2)
+
+    def __snap(self, cents):
+        """
+        A private method that moves a reading back by a harmonic jump if it made one
+
+        Returns: (float, bool), the reading and whether it can be used
+        """
+        offset = cents - self.__cents
+        if abs(offset) <= self.__max_jump:
+            return cents, True
+        for jump in HARMONIC_JUMPS:
+            if abs(abs(offset) - jump) <= self.__snap_tolerance:
+                return cents - math.copysign(jump, offset), False
+        return cents, False
+
+    def __start(self, cents):
+        """Just a private method that starts the Kalman filter over from a pitch of `cents`"""
+        self.__cents = cents
+        self.__rate = 0.0
+        self.__variance = self.__variance_noise
+        self.__covariance = 0.0
+        # the rate isn't known at all yet, it could be anything up to the max jump
+        self.__rate_variance = self.__max_jump * self.__max_jump
+
+    def __remember(self, agreeing):
+        """Just a private method that adds whether a reading agreed to the recent ones"""
+        self.__agreeing.append(agreeing)
+        if len(self.__agreeing) > self.__history:
+            self.__agreeing.pop(0)
+
+    def update(self, freq):
+        """
+        Adds a detected frequency (0.0 if there was none) and updates the tracked pitch
+
+        Returns: float, the tracked frequency in Hz, or 0.0 if there is none yet
+        """
+        if freq <= 0:
+            self.__remember(None)
+            return self.get_freq()
+
+        cents = self.__cents_of(freq)
+        agreeing = True
+        if self.__cents is None:
+            self.__start(cents)
+        else:
+            snapped, agreeing = self.__snap(cents)
+            if agreeing:
+                self.__pending = []
+            else:
+                # a jump, even one that could be snapped back, only moves the tracker over to the new pitch
+                #   once it has held for a few readings in a row
+                if self.__pending and abs(cents - self.__pending[-1]) > self.__max_jump:
+                    self.__pending = []
+                self.__pending.append(cents)
+                if len(self.__pending) >= self.__hold:
+                    pending = self.__pending
+                    self.reset()
+                    for cents in pending:
+                        self.update(self.__reference * 2 ** (cents / 1200))
+                    return self.get_freq()
+                if abs(snapped - self.__cents) > self.__max_jump:
+                    self.__remember(False)
+                    return self.get_freq()
+            cents = snapped
+
+        self.__readings.append(cents)
+        if len(self.__readings) > self.__history:
+            self.__readings.pop(0)
+        median = sorted(self.__readings)[len(self.__readings) // 2]
+
+        # a Kalman filter of the pitch and its rate, where the rate changes a little every reading. First it
+        #   predicts where the pitch has moved to since the last reading
+        drift = self.__variance_drift
+        self.__cents += self.__rate
+        self.__variance += 2 * self.__covariance + self.__rate_variance + drift / 4
+        self.__covariance += self.__rate_variance + drift / 2
+        self.__rate_variance += drift
+        # a reading far from that prediction is a bad one, so the median of the recent readings is used instead,
+        #   unless the median is far from it too, then the pitch has moved and the filter starts over from it.
+        #   Agreement is with the prediction rather than the median, which lags behind while a peg is turned
+        near = abs(cents - self.__cents) <= self.__agreement
+        if not near and abs(median - self.__cents) > self.__agreement:
+            self.__start(median)
+            near = abs(cents - median) <= self.__agreement
+        elif not near:
+            cents = median
+        self.__remember(agreeing and near)
+        # then it moves the pitch and the rate towards the reading, as far as the variances trust it
+        total = self.__variance + self.__variance_noise
+        gain = self.__variance / total
+        rate_gain = self.__covariance / total
+        error = cents - self.__cents
+        self.__cents += gain * error
+        self.__rate += rate_gain * error
+        self.__rate_variance -= rate_gain * self.__covariance
+        self.__covariance *= 1 - gain
+        self.__variance *= 1 - gain
+        return self.get_freq()
+
+    def forget_silence(self):
+        """Forgets the recent readings that found no pitch, for once the string has gone quiet"""
+        self.__agreeing = [agreeing for agreeing in self.__agreeing if agreeing is not None]
+
+    def get_freq(self):
+        """
+        A getter method for the tracked frequency
+
+        Returns: float, in Hz, or 0.0 if there is no pitch yet
+        """
+        if self.__cents is None:
+            return 0.0
+        return self.__reference * 2 ** (self.__cents / 1200)
+
+    def get_cents(self):
+        """
+        A getter method for the tracked pitch in cents from the reference
+
+        Returns: float, or None if there is no pitch yet
+        """
+        return self.__cents
+
+    def get_confidence(self):
+        """
+        A getter method for the fraction of the recent readings that agreed with the tracked pitch
+
+        Returns: float, between 0 and 1
+        """
+        if not self.__agreeing:
+            return 0.0
+        return sum(1 for agreeing in self.__agreeing if agreeing is True) / len(self.__agreeing)
+
+
+class StringLock():
+    '''
+    Locks onto one of `strings` after `required` readings in a row were all within `spread` half-steps of it
+
+    While it is locked, `detect` only searches the lags within `spread` half-steps of that string, on just the
+    end of the frame: enough samples for a template of `periods` periods of the string plus the longest lag.
+    So most of a tuning session, while one peg is being turned, costs a fraction of the full search.
+
+    It unlocks as soon as a reading is silent (no pitch found) or jumps outside the string's window.
+    '''
+
+    def __init__(self, strings = STANDARD_TUNING, required = 4, spread = 2.5, periods = 6, engine = ENGINE_DOT):
+        self.__strings = strings
+        self.__required = required
+        self.__spread = spread
+        self.__periods = periods
+        self.__engine = engine
+        self.__candidate = None #the string the last readings were near
+        self.__count = 0 #how many readings in a row were near it
+        self.__locked = None #the string it is locked onto
+
+    def __nearest(self, freq):
+        """
+        A private method that returns the index of the string closest to `freq` in half-steps, like the note the
+        tuning table picks for the display, or None if even that one is more than `spread` half-steps away
+        """
+        nearest = None
+        closest = self.__spread
+        for i in range(len(self.__strings)):
+            distance = abs(12 * math.log(freq / self.__strings[i], 2))
+            if distance <= closest:
+                nearest = i
+                closest = distance
+        return nearest
+
+    def update(self, freq):
+        """Adds a detected frequency (0.0 if there was none), which can lock or unlock it"""
+        if freq <= 0:
+            self.unlock()
+            return
+        nearest = self.__nearest(freq)
+        if self.__locked is not None:
+            if nearest != self.__locked:
+                self.unlock()
+            return
+
+        if nearest is None or nearest != self.__candidate:
+            self.__candidate = nearest
+            self.__count = 0
+        if nearest is not None:
+            self.__count += 1
+            if self.__count >= self.__required:
+                self.__locked = nearest
+
+    def unlock(self):
+        """Unlocks it, and starts counting readings again from scratch"""
+        self.__locked = None
+        self.__candidate = None
+        self.__count = 0
+
+    def get_band(self):
+        """
+        A getter method for the band of frequencies the locked string's window covers
+
+        Returns: (float, float), the lowest and highest frequency in Hz, or None if it isn't locked
+        """
+        if self.__locked is None:
+            return None
+        target = self.__strings[self.__locked]
+        return (target * 2 ** (-self.__spread / 12), target * 2 ** (self.__spread / 12))
+
+    def __get_search_band(self, time_delta):
+        """
+        A private method that returns the band `detect` searches, the string's window, but at least two lags
+        either side of its period. The window of a high note in chromatic mode can be narrower than a lag,
+        and then the peak would always be on its edge
+        """
+        low, high = self.get_band()
+        period = 1 / (self.__strings[self.__locked] * time_delta)
+        return (min(low, 1 / ((period + 2) * time_delta)), max(high, 1 / (max(1.0, period - 2) * time_delta)))
+
+    def get_frame_length(self, time_delta):
+        """
+        A getter method for how many samples `detect` uses while locked
+
+        Returns: int, or 0 if it isn't locked
+        """
+        if self.__locked is None:
+            return 0
+        low, high = self.__get_search_band(time_delta)
+        min_lag, max_lag = lag_bounds(time_delta, low, high)
+        return int(self.__periods / (self.__strings[self.__locked] * time_delta)) + max_lag + 2
+
+    def detect(self, wave, time_delta):
+        """
+        The pitch detector for while it is locked, with the same inputs and output as the ones in
+        pitchFunctions, which only looks for the locked string's pitch in the end of `wave`
+
+        Returns: float, the frequency in Hz, or 0.0 if it isn't locked or the pitch isn't in the string's window
+        """
+        if self.__locked is None:
+            return 0.0
+        low, high = self.__get_search_band(time_delta)
+        length = self.get_frame_length(time_delta)
+        if len(wave) > length:
+            wave = wave[len(wave) - length:]
+        lag = get_lag_band(wave, time_delta, self.__engine, length, 0.91, low, high)
+        if lag == 0:
+            return 0.0
+        return float(1 / (lag * time_delta))
+
+    def is_locked(self):
+        """
+        A getter method for whether it is locked onto a string
+
+        Returns: bool
+        """
+        return self.__locked is not None
+
+    def get_string(self):
+        """
+        A getter method for the frequency of the string it is locked onto
+
+        Returns: float, in Hz, or 0.0 if it isn't locked
+        """
+        if self.__locked is None:
+            return 0.0
+        return self.__strings[self.__locked]
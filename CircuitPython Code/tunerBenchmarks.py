@@ -0,0 +1,440 @@
+"""
+Benchmarks for the tuner's pitch detection
+
+These run on the Feather (with ulab) as well as on a computer (with NumPy), the backend is picked by
+arrayFunctions. Instead of a guitar they use a synthetic pluck: a few decaying harmonics plus some noise,
+sampled at the ~12.5 kHz the Tuner.py capture loop manages.
+
+Run this file directly to run all of them, or call a single benchmark function from the REPL
+"""
+
+import gc
+import math
+import random
+import time
+from array import array
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+from arrayFunctions import BACKEND, as_float, as_samples
+import correlationFunctions
+import filterFunctions
+import pitchFunctions
+import tuningFunctions
+
+SAMPLE_RATE = 12500
+
+# The six open strings in standard tuning, same as Tuner.py
+STRINGS = (
+    ("E2", 82.407),
+    ("A2", 110.000),
+    ("D3", 146.832),
+    ("G3", 195.998),
+    ("B3", 246.942),
+    ("E4", 329.628),
+)
+
+
+def synth_pluck(freq, length, rate = SAMPLE_RATE, seed = 0):
+    """
+    Returns a list of `length` voltages that sound roughly like a plucked string at `freq` Hz
+
+    The harmonics are louder than the fundamental on purpose, like on the low strings of a real guitar.
+    Harmonics above half the sample rate are left out, like the input's anti-aliasing would.
+    The random module is seeded with `seed` (CircuitPython has no random.Random), and the noise is a sum of
+    uniform numbers since it has no random.gauss either
+    """
+    random.seed(seed)
+    harmonics = ((1, 0.6), (2, 1.0), (3, 0.5), (4, 0.3), (5, 0.15))
+    phases = [random.uniform(0, 2 * math.pi) for h in harmonics]
+    wave = []
+    for n in range(length):
+        t = n / rate
+        value = 0.0
+        for (h, amplitude), phase in zip(harmonics, phases):
+            if h * freq >= rate / 2:
+                break
+            value += amplitude * math.exp(-1.5 * h * t) * math.sin(2 * math.pi * h * freq * t + phase)
+        # three uniform numbers add up to roughly a bell curve, this one with a standard deviation of 0.01
+        noise = 0.02 * (random.random() + random.random() + random.random() - 1.5)
+        wave.append(1.65 + 0.4 * value + noise)
+    return wave
+
+
+def center(wave):
+    """Same as center() in Tuner.py, returns a copy so the original frame can be reused"""
+    avg = float(sum(wave) / len(wave))
+    return [x - avg for x in wave]
+
+
+def time_call(function, args, repeat = 5):
+    """Calls function(*args) `repeat` times and returns (best time in ms, last result)"""
+    best = None
+    result = None
+    for i in range(repeat):
+        start = time.monotonic_ns()
+        result = function(*args)
+        elapsed = (time.monotonic_ns() - start) / 1000000
+        if best is None or elapsed < best:
+            best = elapsed
+    return best, result
+
+
+def cents(freq, reference):
+    """Returns how many cents `freq` is away from `reference`, or None if nothing was detected"""
+    if freq <= 0 or reference <= 0:
+        return None
+    return 1200 * math.log(freq / reference, 2)
+
+
+def __freq_from_correlation(correlation):
+    lag = correlationFunctions.pick_peaks(correlation)
+    if lag == 0:
+        return 0.0
+    return SAMPLE_RATE / lag
+
+
+def bench_correlation_engines(frame_sizes = (1024, 2048, 4096), template_size = 512, repeat = 5):
+    """
+    Compares the fft correlation engine against the original convolution for every string
+
+    Prints the per-frame latency of computing the correlation with each engine and how far apart
+    (in cents) the frequencies detected from them are
+    """
+    print("Correlation engines (" + BACKEND + " backend)")
+    print("frame  string  convolve ms  fft ms  speedup  convolve Hz  fft Hz  diff cents")
+    for size in frame_sizes:
+        for name, freq in STRINGS:
+            wave = center(synth_pluck(freq, size))
+            conv_ms, conv_corr = time_call(correlationFunctions.correlate,
+                (wave, correlationFunctions.ENGINE_CONVOLVE, template_size), repeat)
+            fft_ms, fft_corr = time_call(correlationFunctions.correlate,
+                (wave, correlationFunctions.ENGINE_FFT, template_size), repeat)
+            conv_freq = __freq_from_correlation(conv_corr)
+            fft_freq = __freq_from_correlation(fft_corr)
+            diff = cents(fft_freq, conv_freq)
+            print("{:5d}  {:6s}  {:11.3f}  {:6.3f}  {:6.1f}x  {:11.2f}  {:6.2f}  {:>10s}".format(
+                size, name, conv_ms, fft_ms, conv_ms / fft_ms, conv_freq, fft_freq,
+                "-" if diff is None else "{:.2f}".format(diff)))
+
+
+def __lag_from_wave(wave, template_size):
+    return correlationFunctions.pick_peaks(
+        correlationFunctions.correlate(wave, correlationFunctions.ENGINE_FFT, template_size))
+
+
+def __format_cents(freq, reference):
+    offset = cents(freq, reference)
+    if offset is None:
+        return "-"
+    return "{:.1f}".format(offset)
+
+
+def bench_yin(frame_sizes = (512, 1024, 2048), repeat = 5):
+    """
+    Compares the accuracy (in cents from the true pitch) and latency of YIN against the
+    correlation peak walk, for every string at each frame size
+    """
+    time_delta = 1 / SAMPLE_RATE
+    print("YIN vs correlation (" + BACKEND + " backend)")
+    print("frame  string  correlation ms  cents  yin ms  cents")
+    for size in frame_sizes:
+        template_size = min(512, size // 4)
+        for name, freq in STRINGS:
+            wave = center(synth_pluck(freq, size))
+            corr_ms, corr_lag = time_call(__lag_from_wave, (wave, template_size), repeat)
+            yin_ms, yin_freq = time_call(pitchFunctions.get_freq_yin, (wave, time_delta), repeat)
+            corr_freq = SAMPLE_RATE / corr_lag if corr_lag else 0.0
+            print("{:5d}  {:6s}  {:14.3f}  {:>5s}  {:6.3f}  {:>5s}".format(size, name,
+                corr_ms, __format_cents(corr_freq, freq), yin_ms, __format_cents(yin_freq, freq)))
+
+
+def bench_streaming(window = 2048, hops = (128, 256, 512), max_lag = 256, repeat = 5):
+    """
+    Compares the cost of a reading from the streaming correlator (one push of `hop` new samples) against
+    recomputing the full 2048 sample correlation, and the pitch each one finds on the A string
+    """
+    time_delta = 1 / SAMPLE_RATE
+    freq = 110.0
+    wave = synth_pluck(freq, 4 * window)
+    full_ms, full_lag = time_call(__lag_from_wave, (center(wave[-window:]), 512), repeat)
+    print("Streaming correlator (" + BACKEND + " backend)")
+    print("full frame: {:.3f} ms per reading, {} cents".format(
+        full_ms, __format_cents(SAMPLE_RATE / full_lag if full_lag else 0.0, freq)))
+    print("  hop  push ms  readings/s  cents")
+    for hop in hops:
+        streaming = correlationFunctions.StreamingCorrelator(window, max_lag, hop)
+        last = len(wave) - repeat * hop
+        for start in range(0, last, hop):
+            streaming.push(wave[start:start + hop])
+
+        # times the last few pushes, which have to be new samples to keep the signal continuous
+        push_ms = None
+        for start in range(last, len(wave), hop):
+            elapsed, result = time_call(streaming.push, (wave[start:start + hop],), 1)
+            if push_ms is None or elapsed < push_ms:
+                push_ms = elapsed
+        print("{:5d}  {:7.3f}  {:10.1f}  {:>5s}".format(hop, push_ms, SAMPLE_RATE / hop,
+            __format_cents(streaming.get_freq(time_delta), freq)))
+
+
+def load_correlations(path):
+    """
+    Loads recorded correlation arrays from a text file, one array per line with the values separated by
+    commas, like the ones printed by `print(",".join(str(x) for x in correlation))` on the board
+    """
+    correlations = []
+    with open(path) as recording:
+        for line in recording:
+            if line.strip():
+                correlations.append(as_float([float(x) for x in line.split(",")]))
+    return correlations
+
+
+def bench_peak_picking(path = None, repeat = 5):
+    """
+    Compares the array based pick_peaks against the original walk_peaks loops
+
+    Uses the correlation arrays recorded in the file at `path` (see `load_correlations`), or if there is
+    none, the correlations of the synthetic plucks of every string. Prints how long each takes and
+    whether they found the same lag
+    """
+    if path is None:
+        correlations = [correlationFunctions.correlate(center(synth_pluck(freq, 2048)),
+            correlationFunctions.ENGINE_FFT) for name, freq in STRINGS]
+        names = [name for name, freq in STRINGS]
+    else:
+        correlations = load_correlations(path)
+        names = [str(i) for i in range(len(correlations))]
+
+    print("Peak picking (" + BACKEND + " backend)")
+    print("array  walk ms  pick ms  speedup  walk lag  pick lag")
+    for name, correlation in zip(names, correlations):
+        walk_ms, walk_lag = time_call(correlationFunctions.walk_peaks, (correlation,), repeat)
+        pick_ms, pick_lag = time_call(correlationFunctions.pick_peaks, (correlation,), repeat)
+        print("{:5s}  {:7.3f}  {:7.3f}  {:6.1f}x  {:8d}  {:8d}".format(
+            name, walk_ms, pick_ms, walk_ms / pick_ms, walk_lag, pick_lag))
+
+
+def bench_multirate(size = 2048, factor = 4, engine = correlationFunctions.ENGINE_CONVOLVE, repeat = 5):
+    """
+    Compares the coarse to fine detector against the full rate band-limited search for every string
+
+    Both use the same correlation engine (direct convolution by default, which is what the decimation
+    saves the most on). Prints the time for each, the speedup, and their errors in cents.
+    On NumPy the time is mostly Python overhead, so the number of multiply-adds the direct correlation
+    needs in each case is printed as well, which is what the time follows on the board
+    """
+    time_delta = 1 / SAMPLE_RATE
+    template_size = 512
+    min_lag, max_lag = correlationFunctions.lag_bounds(time_delta)
+    full_macs = (max_lag - min_lag + 2 + template_size) * template_size
+    coarse_template = template_size // factor
+    multi_macs = ((max_lag - min_lag) // factor + 2 + coarse_template) * coarse_template \
+        + (2 * factor + 3) * template_size
+    print("Coarse to fine, " + str(factor) + "x decimation (" + BACKEND + " backend, " + engine + " engine)")
+    print("multiply-adds: {} full, {} multirate ({:.1f}x fewer)".format(full_macs, multi_macs,
+        full_macs / multi_macs))
+    print("string  full ms  cents  multirate ms  cents  speedup")
+    for name, freq in STRINGS:
+        wave = as_float(center(synth_pluck(freq, size)))
+        full_ms, full_lag = time_call(correlationFunctions.get_lag_band,
+            (wave, time_delta, engine), repeat)
+        multi_ms, multi_lag = time_call(correlationFunctions.get_lag_multirate,
+            (wave, time_delta, factor, engine), repeat)
+        print("{:6s}  {:7.3f}  {:>5s}  {:12.3f}  {:>5s}  {:6.1f}x".format(name,
+            full_ms, __format_cents(SAMPLE_RATE / full_lag if full_lag else 0.0, freq),
+            multi_ms, __format_cents(SAMPLE_RATE / multi_lag if multi_lag else 0.0, freq),
+            full_ms / multi_ms))
+
+
+def bench_goertzel(size = 2048, rate = 10000, detune = (0, -40, 40, -230, 230), repeat = 5):
+    """
+    Compares the Goertzel string picking + narrow lag search against the band-limited search over the whole
+    guitar (both with the dot product engine), for every string played in tune and detuned by `detune` cents
+
+    Prints the time for each, their errors in cents, and how many lags each one correlates. The number of
+    multiply-adds each needs (and the original full convolution needed) is printed as well, the Goertzel bank
+    takes a cosine and a sine dot product of the decimated samples for each of its filters
+    """
+    time_delta = 1 / rate
+    template_size = 512
+    factor = 8
+    min_lag, max_lag = correlationFunctions.lag_bounds(time_delta)
+    filters = 6 * (2 * 5 + 1)
+    low, high = correlationFunctions.lag_bounds(time_delta, STRINGS[0][1] * 2 ** (-2.5 / 12),
+                                                STRINGS[0][1] * 2 ** (2.5 / 12))
+    print("Goertzel string picking (" + BACKEND + " backend, " + str(rate) + " Hz, " + str(size) + " samples)")
+    print("multiply-adds: {} full convolution, {} band, {} goertzel (at most)".format(
+        size * template_size, (max_lag - min_lag + 3) * template_size,
+        2 * filters * (size // factor) + (high - low + 3) * template_size))
+    print("string  detune  band ms  cents  lags  goertzel ms  cents  lags")
+    for name, freq in STRINGS:
+        for offset in detune:
+            actual = freq * 2 ** (offset / 1200)
+            wave = as_float(center(synth_pluck(actual, size, rate)))
+            band_ms, band_lag = time_call(correlationFunctions.get_lag_band,
+                (wave, time_delta, correlationFunctions.ENGINE_DOT), repeat)
+            goertzel_ms, goertzel_freq = time_call(pitchFunctions.get_freq_goertzel, (wave, time_delta), repeat)
+            low, high = correlationFunctions.lag_bounds(time_delta, freq * 2 ** (-2.5 / 12), freq * 2 ** (2.5 / 12))
+            print("{:6s}  {:6d}  {:7.3f}  {:>5s}  {:4d}  {:11.3f}  {:>5s}  {:4d}".format(name, offset,
+                band_ms, __format_cents(rate / band_lag if band_lag else 0.0, actual), max_lag - min_lag + 3,
+                goertzel_ms, __format_cents(goertzel_freq, actual), high - low + 3))
+
+
+def bench_hps(frame_sizes = (1024, 2048), repeat = 5):
+    """
+    Compares the accuracy (in cents from the true pitch) and latency of the harmonic product spectrum
+    against the original full correlation (direct convolution and the peak walk) and the band-limited
+    correlation with the fft engine, for every string at each frame size
+    """
+    time_delta = 1 / SAMPLE_RATE
+    print("Harmonic product spectrum vs correlation (" + BACKEND + " backend)")
+    print("frame  string  convolve ms  cents  band ms  cents  hps ms  cents")
+    for size in frame_sizes:
+        template_size = min(512, size // 4)
+        for name, freq in STRINGS:
+            wave = as_float(center(synth_pluck(freq, size)))
+            conv_ms, conv_lag = time_call(__lag_from_convolution, (wave, template_size), repeat)
+            band_ms, band_lag = time_call(correlationFunctions.get_lag_band,
+                (wave, time_delta, correlationFunctions.ENGINE_FFT, template_size), repeat)
+            hps_ms, hps_freq = time_call(pitchFunctions.get_freq_hps, (wave, time_delta), repeat)
+            print("{:5d}  {:6s}  {:11.3f}  {:>5s}  {:7.3f}  {:>5s}  {:6.3f}  {:>5s}".format(size, name,
+                conv_ms, __format_cents(SAMPLE_RATE / conv_lag if conv_lag else 0.0, freq),
+                band_ms, __format_cents(SAMPLE_RATE / band_lag if band_lag else 0.0, freq),
+                hps_ms, __format_cents(hps_freq, freq)))
+
+
+def check_chromatic(size = 1024, rate = 10000, detune = (0, -30, 30)):
+    """
+    Checks that every note of the chromatic mode's range (see ChromaticTable in tuningFunctions) is found,
+    played in tune and detuned by `detune` cents, to within half a step of the played pitch. Uses YIN over the whole range, like Tuner.py does in
+    chromatic mode, and the band-limited correlation for comparison, which picks multiples of the period
+
+    Prints every note either one gets wrong, and how many of them each one got right. Returns whether
+    YIN got all of them
+    """
+    time_delta = 1 / rate
+    table = tuningFunctions.ChromaticTable()
+    low, high = table.get_band()
+    print("Chromatic range check, " + str(low) + " to " + str(high) + " Hz (" + BACKEND + " backend, "
+          + str(rate) + " Hz, " + str(size) + " samples)")
+    print("note  detune  expected Hz  yin Hz  cents  band Hz  cents")
+    yin_right = 0
+    band_right = 0
+    total = 0
+    for target in table.get_freqs():
+        note = table.lookup(target)
+        for offset in detune:
+            actual = target * 2 ** (offset / 1200)
+            if not low <= actual <= high:
+                continue
+            wave = as_float(center(synth_pluck(actual, size, rate)))
+            yin_freq = pitchFunctions.get_freq_yin(wave, time_delta, 0.15, low, high)
+            band_lag = correlationFunctions.get_lag_band(wave, time_delta, correlationFunctions.ENGINE_FFT,
+                                                         512, 0.91, low, high)
+            band_freq = rate / band_lag if band_lag else 0.0
+            yin_ok = yin_freq > 0 and abs(cents(yin_freq, actual)) < 50
+            band_ok = band_freq > 0 and abs(cents(band_freq, actual)) < 50
+            yin_right += yin_ok
+            band_right += band_ok
+            total += 1
+            if not (yin_ok and band_ok):
+                print("{:4s}  {:6d}  {:11.2f}  {:6.1f}  {:>5s}  {:7.1f}  {:>5s}".format(table.get_name(note),
+                    offset, actual, yin_freq, __format_cents(yin_freq, actual), band_freq,
+                    __format_cents(band_freq, actual)))
+    print("yin found {} of {} notes, band {} of {}".format(yin_right, total, band_right, total))
+    return yin_right == total
+
+
+def __lag_from_convolution(wave, template_size):
+    return correlationFunctions.pick_peaks(
+        correlationFunctions.correlate(wave, correlationFunctions.ENGINE_CONVOLVE, template_size))
+
+
+def measure_allocation(function, args):
+    """
+    Calls function(*args) once and returns how many bytes it allocated
+
+    On the board this is how much gc.mem_alloc() went up, with the garbage collector left on like in
+    FrameContext (if a collection runs in the middle it counts as 0). On a computer it is the peak memory
+    traced by tracemalloc (NumPy reports its arrays to it too), which is left tracing if it already was,
+    since a FrameContext may be tracing with it
+    """
+    if tracemalloc is not None:
+        tracing = tracemalloc.is_tracing()
+        if not tracing:
+            tracemalloc.start()
+        tracemalloc.reset_peak()
+        before = tracemalloc.get_traced_memory()[0]
+        function(*args)
+        peak = tracemalloc.get_traced_memory()[1] - before
+        if not tracing:
+            tracemalloc.stop()
+        return peak
+
+    gc.collect()
+    before = gc.mem_alloc()
+    function(*args)
+    return max(0, gc.mem_alloc() - before)
+
+
+def to_raw(wave):
+    """Returns `wave` (in volts) as an array('H') of raw 16-bit samples, like the capture fills"""
+    return array('H', [min(65535, max(0, int(x * 65536 / 3.3))) for x in wave])
+
+
+def __float_front_end(samples):
+    # the old path, a list of volts made one float at a time and then centered
+    return center([(x * 3.3) / 65536 for x in samples])
+
+
+def __float_path(samples, time_delta):
+    return pitchFunctions.get_freq_yin(__float_front_end(samples), time_delta)
+
+
+def __raw_path(samples, time_delta, conditioner):
+    return pitchFunctions.get_freq_yin(conditioner.push(as_samples(samples)), time_delta)
+
+
+def bench_allocations(size = 2048, repeat = 5):
+    """
+    Compares the memory allocated for one frame by the old list of floats path (converting every sample
+    to volts, then centering) against the raw path (a view of the raw samples straight into the filters),
+    on their own and together with the YIN pitch detection
+
+    On a computer without SciPy the filters are a Python loop (see sosfilt in arrayFunctions), so the raw
+    path is slower there than the floats path. On the board they are ulab's sosfilt, which runs in C
+    """
+    time_delta = 1 / SAMPLE_RATE
+    samples = to_raw(synth_pluck(110.0, size))
+    conditioner = filterFunctions.SignalConditioner(SAMPLE_RATE, size)
+    conditioner.push(as_samples(samples))
+
+    float_bytes = measure_allocation(__float_front_end, (samples,))
+    raw_bytes = measure_allocation(conditioner.push, (as_samples(samples),))
+    float_total = measure_allocation(__float_path, (samples, time_delta))
+    raw_total = measure_allocation(__raw_path, (samples, time_delta, conditioner))
+    float_ms, float_freq = time_call(__float_path, (samples, time_delta), repeat)
+    raw_ms, raw_freq = time_call(__raw_path, (samples, time_delta, conditioner), repeat)
+
+    method = "tracemalloc peak" if tracemalloc is not None else "gc.mem_free delta"
+    print("Allocations per " + str(size) + " sample frame (" + BACKEND + " backend, " + method + ")")
+    print("path    front end bytes  with yin bytes  with yin ms    Hz")
+    print("floats  {:15d}  {:14d}  {:11.3f}  {:6.2f}".format(float_bytes, float_total, float_ms, float_freq))
+    print("raw     {:15d}  {:14d}  {:11.3f}  {:6.2f}".format(raw_bytes, raw_total, raw_ms, raw_freq))
+
+
+if __name__ == "__main__":
+    bench_correlation_engines()
+    bench_yin()
+    bench_streaming()
+    bench_peak_picking()
+    bench_multirate()
+    bench_goertzel()
+    bench_hps()
+    bench_allocations()
+    check_chromatic()
@@ -0,0 +1,274 @@
+"""
+Tunings for the guitar tuner
+
+A TuningTable holds the notes of a tuning worked out once from the A4 reference: their frequencies, the
+midpoints between neighbouring notes (in log2 of the frequency, where the half-steps are evenly spaced) and
+the LED of the ring each one lights up. Finding the note a frequency belongs to is then a binary search of
+the midpoints, however many strings there are.
+
+PRESETS has the common tunings by name, and `get_tuning` makes the table of one of them.
+
+A ChromaticTable works the same way for every note of 12 tone equal temperament instead of the strings of a
+tuning, so the tuner works for any note of any instrument. There the note is just the nearest half-step,
+one log2 and a round, and each of the 12 note names has its own LED.
+"""
+
+import math
+
+try:
+    from bisect import bisect_right
+except ImportError:
+    # CircuitPython doesn't have bisect, so this is the same binary search
+    def bisect_right(values, x):
+        low = 0
+        high = len(values)
+        while low < high:
+            middle = (low + high) // 2
+            if x < values[middle]:
+                high = middle
+            else:
+                low = middle + 1
+        return low
+
+# The concert pitch every note is worked out from, in Hz
+A4 = 440.0
+
+NOTE_NAMES = ("C", "C#", "D", "D#", "E", "F", "F#", "G", "G#", "A", "A#", "B")
+
+# The notes of each tuning, from the lowest string to the highest
+PRESETS = {
+    "standard": ("E2", "A2", "D3", "G3", "B3", "E4"),
+    "drop D": ("D2", "A2", "D3", "G3", "B3", "E4"),
+    "DADGAD": ("D2", "A2", "D3", "G3", "A3", "D4"),
+    "open G": ("D2", "G2", "D3", "G3", "B3", "D4"),
+    "half-step down": ("D#2", "G#2", "C#3", "F#3", "A#3", "D#4"),
+    "7-string": ("B1", "E2", "A2", "D3", "G3", "B3", "E4"),
+    "bass": ("E1", "A1", "D2", "G2"),
+}
+
+
+def note_number(name):
+    """
+    Returns the MIDI note number of a note name like "E2" or "C#3" (A4 is 69)
+
+    Raises ValueError if it isn't a note name
+    """
+    for length in (2, 1):
+        if name[0:length] in NOTE_NAMES and len(name) > length:
+            try:
+                octave = int(name[length:])
+            except ValueError:
+                break
+            return 12 * (octave + 1) + NOTE_NAMES.index(name[0:length])
+    raise ValueError("Not a note name: " + str(name))
+
+
+def note_freq(name, reference = A4):
+    """Returns the frequency of a note name like "E2" in Hz, in 12 tone equal temperament from `reference`"""
+    return reference * 2 ** ((note_number(name) - 69) / 12)
+
+
+class TuningTable():
+    '''
+    The notes of a tuning, and the lookup of which one a frequency is closest to
+
+    `notes` are note names from the lowest string to the highest. Frequencies more than `spread` half-steps
+    below the lowest note or above the highest don't belong to any of them. String i lights up LED
+    `first_led` - i, so in standard tuning the low E is LED 21 and the high E is LED 16.
+    '''
+
+    def __init__(self, notes, reference = A4, spread = 2.5, first_led = 21):
+        self.__names = tuple(notes)
+        self.__reference = reference
+        self.__freqs = tuple(note_freq(name, reference) for name in notes)
+        self.__logs = tuple(math.log(freq, 2) for freq in self.__freqs)
+        # in log2 the midpoint between two notes is the average, which is also the geometric mean in Hz
+        self.__midpoints = [(self.__logs[i] + self.__logs[i + 1]) / 2 for i in range(len(notes) - 1)]
+        self.__spread = spread
+        self.__low = self.__logs[0] - spread / 12
+        self.__high = self.__logs[-1] + spread / 12
+        self.__leds = tuple(first_led - i for i in range(len(notes)))
+
+    def lookup(self, freq):
+        """
+        Finds the note `freq` is closest to
+
+        Returns: int, the index of the note, or None if `freq` is outside the range of the tuning
+        """
+        if freq <= 0:
+            return None
+        log_freq = math.log(freq, 2)
+        if log_freq < self.__low or log_freq >= self.__high:
+            return None
+        return bisect_right(self.__midpoints, log_freq)
+
+    def get_offset(self, freq, index):
+        """
+        A getter method for how far `freq` is from note `index`
+
+        Returns: float, in half-steps, negative when flat
+        """
+        return 12 * (math.log(freq, 2) - self.__logs[index])
+
+    def get_name(self, index):
+        """
+        A getter method for the name of note `index`
+
+        Returns: str
+        """
+        return self.__names[index]
+
+    def get_names(self):
+        """
+        A getter method for the note names
+
+        Returns: tuple of str
+        """
+        return self.__names
+
+    def get_freqs(self):
+        """
+        A getter method for the frequencies of the notes
+
+        Returns: tuple of float, in Hz
+        """
+        return self.__freqs
+
+    def get_led(self, index):
+        """
+        A getter method for the LED that note `index` lights up
+
+        Returns: int
+        """
+        return self.__leds[index]
+
+    def get_leds(self):
+        """
+        A getter method for the LEDs of all the notes, from the lowest note to the highest
+
+        Returns: tuple of int
+        """
+        return self.__leds
+
+    def get_band(self):
+        """
+        A getter method for the range of frequencies that belong to a note of the tuning
+
+        Returns: (float, float), the lowest and highest frequency in Hz
+        """
+        return (2 ** self.__low, 2 ** self.__high)
+
+    def get_spread(self):
+        """
+        A getter method for how far from a note a frequency can be and still belong to it
+
+        Returns: float, in half-steps
+        """
+        return self.__spread
+
+    def get_reference(self):
+        """
+        A getter method for the A4 reference the notes were worked out from
+
+        Returns: float, in Hz
+        """
+        return self.__reference
+
+
+class ChromaticTable():
+    '''
+    Every note of 12 tone equal temperament from `low` to `high` Hz, with the same methods as a TuningTable
+
+    The notes are MIDI note numbers (A4 is 69), so the note of a frequency is just the nearest whole number of
+    half-steps from `reference`, with no search at all. Note C lights up LED `first_led`, C# the one before it
+    and so on down to B, so the 12 note names take up 12 LEDs of the ring.
+    '''
+
+    def __init__(self, reference = A4, low = 30.0, high = 1500.0, first_led = 23):
+        self.__reference = reference
+        self.__low = low
+        self.__high = high
+        self.__leds = tuple(first_led - i for i in range(12))
+
+    def lookup(self, freq):
+        """
+        Finds the note `freq` is closest to
+
+        Returns: int, the MIDI note number, or None if `freq` is outside the range
+        """
+        if freq < self.__low or freq >= self.__high:
+            return None
+        return int(round(12 * math.log(freq / self.__reference, 2))) + 69
+
+    def get_offset(self, freq, index):
+        """
+        A getter method for how far `freq` is from note `index`
+
+        Returns: float, in half-steps, negative when flat
+        """
+        return 12 * math.log(freq / self.__reference, 2) + 69 - index
+
+    def get_name(self, index):
+        """
+        A getter method for the name of note `index`, like "A4"
+
+        Returns: str
+        """
+        return NOTE_NAMES[index % 12] + str(index // 12 - 1)
+
+    def get_freqs(self):
+        """
+        A getter method for the frequencies of all the notes in the range
+
+        Returns: tuple of float, in Hz
+        """
+        first = self.lookup(self.__low * 2 ** (0.5 / 12))
+        last = self.lookup(self.__high * 2 ** (-0.5 / 12))
+        return tuple(self.__reference * 2 ** ((note - 69) / 12) for note in range(first, last + 1))
+
+    def get_led(self, index):
+        """
+        A getter method for the LED of the name of note `index`, the same for every octave
+
+        Returns: int
+        """
+        return self.__leds[index % 12]
+
+    def get_leds(self):
+        """
+        A getter method for the LEDs of the 12 note names, from C to B
+
+        Returns: tuple of int
+        """
+        return self.__leds
+
+    def get_band(self):
+        """
+        A getter method for the range of frequencies it covers
+
+        Returns: (float, float), the lowest and highest frequency in Hz
+        """
+        return (self.__low, self.__high)
+
+    def get_spread(self):
+        """
+        A getter method for how far from a note a frequency can be and still belong to it
+
+        Returns: float, in half-steps
+        """
+        return 0.5
+
+    def get_reference(self):
+        """
+        A getter method for the A4 reference the notes are worked out from
+
+        Returns: float, in Hz
+        """
+        return self.__reference
+
+
+def get_tuning(preset = "standard", reference = A4):
+    """Returns the TuningTable of one of the PRESETS, worked out from the A4 `reference` in Hz"""
+    if preset not in PRESETS:
+        raise ValueError("Unknown tuning: " + str(preset) + ", the presets are " + ", ".join(PRESETS))
+    return TuningTable(PRESETS[preset], reference)